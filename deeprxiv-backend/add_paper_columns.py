@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+import sqlite3
+import os
+import json
+
+def add_missing_paper_columns():
+    """Add missing columns to the papers and paper_images tables"""
+
+    db_path = "deeprxiv.db"
+
+    if not os.path.exists(db_path):
+        print(f"❌ Database file {db_path} not found!")
+        return
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        # Define columns to add
+        new_columns = {
+            'papers': {
+                'page_offsets': 'TEXT',  # JSON array of each page's start offset in extracted_text
+                'pdf_blob_key': 'TEXT',  # PDF file in the blob store
+                'pdf_size': 'INTEGER',
+                'pdf_sha256': 'TEXT',
+                'content_indexed': 'BOOLEAN DEFAULT 0'  # Extracted text indexed before sections finish
+            },
+            'paper_images': {
+                'blob_key': 'TEXT'  # Content-addressed key of the figure in the blob store
+            }
+        }
+
+        for table_name, table_columns in new_columns.items():
+            # Check current schema
+            cursor.execute(f"PRAGMA table_info({table_name})")
+            existing_columns = [row[1] for row in cursor.fetchall()]
+            if not existing_columns:
+                print(f"ℹ️ Table {table_name} does not exist yet, it will be created with all columns")
+                continue
+            print(f"📋 Existing {table_name} columns: {existing_columns}")
+
+            # Add missing columns
+            for column_name, column_type in table_columns.items():
+                if column_name not in existing_columns:
+                    try:
+                        alter_sql = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"
+                        cursor.execute(alter_sql)
+                        print(f"✅ Added column: {table_name}.{column_name} ({column_type})")
+                    except sqlite3.Error as e:
+                        print(f"❌ Error adding column {table_name}.{column_name}: {e}")
+                else:
+                    print(f"ℹ️ Column {table_name}.{column_name} already exists")
+
+            # Verify the new schema
+            cursor.execute(f"PRAGMA table_info({table_name})")
+            updated_columns = [row[1] for row in cursor.fetchall()]
+            print(f"📋 Updated {table_name} columns: {updated_columns}")
+
+        # Commit changes
+        conn.commit()
+        print("✅ Database migration completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+PDF_CHUNK_SIZE = 1024 * 1024
+
+def migrate_pdf_blobs():
+    """Move PDFs out of papers.pdf_data into the blob store, streaming each one"""
+    from blob_store import get_blob_store
+
+    db_path = "deeprxiv.db"
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    blob_store = get_blob_store()
+
+    try:
+        cursor.execute("SELECT id, arxiv_id FROM papers WHERE pdf_data IS NOT NULL AND pdf_blob_key IS NULL")
+        papers = cursor.fetchall()
+        print(f"📦 {len(papers)} PDFs to move into the blob store")
+
+        moved_bytes = 0
+        for paper_id, arxiv_id in papers:
+            # Read the column a slice at a time instead of loading the whole PDF
+            key, size = blob_store.put_stream(read_pdf_column(cursor, paper_id), "pdf")
+
+            cursor.execute(
+                "UPDATE papers SET pdf_blob_key = ?, pdf_size = ?, pdf_sha256 = ?, pdf_data = NULL WHERE id = ?",
+                (key, size, key.split(".", 1)[0], paper_id)
+            )
+            conn.commit()
+            moved_bytes += size
+            print(f"✅ {arxiv_id}: stored {size} bytes as {key}")
+
+        if papers:
+            print(f"ℹ️ Moved {moved_bytes} bytes; run VACUUM on {db_path} to return the space to the filesystem")
+    except Exception as e:
+        print(f"❌ PDF migration failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def read_pdf_column(cursor, paper_id):
+    """Yield papers.pdf_data in PDF_CHUNK_SIZE slices (plain SELECTs, so any Python 3 sqlite3 works)"""
+    cursor.execute("SELECT length(pdf_data) FROM papers WHERE id = ?", (paper_id,))
+    length = cursor.fetchone()[0] or 0
+    # substr() on a BLOB is 1-indexed and counts bytes
+    for start in range(1, length + 1, PDF_CHUNK_SIZE):
+        cursor.execute("SELECT substr(pdf_data, ?, ?) FROM papers WHERE id = ?", (start, PDF_CHUNK_SIZE, paper_id))
+        yield cursor.fetchone()[0]
+
+def load_pdf(cursor, paper_id, arxiv_id):
+    """A paper's PDF from the blob store, or from pdf_data if it has not been migrated"""
+    from pdf_processor import load_stored_pdf
+
+    cursor.execute("SELECT pdf_blob_key, pdf_size, pdf_sha256 FROM papers WHERE id = ?", (paper_id,))
+    blob_key, size, sha256 = cursor.fetchone()
+
+    def legacy_pdf_data():
+        cursor.execute("SELECT pdf_data FROM papers WHERE id = ?", (paper_id,))
+        return cursor.fetchone()[0]
+
+    return load_stored_pdf(blob_key, size, sha256, fallback=legacy_pdf_data, label=arxiv_id)
+
+def backfill_page_offsets():
+    """Compute page offsets for papers processed before they were stored"""
+    from pdf_processor import PDFProcessor
+
+    db_path = "deeprxiv.db"
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    pdf_processor = PDFProcessor()
+
+    try:
+        cursor.execute("""
+            SELECT id FROM papers
+            WHERE page_offsets IS NULL AND extracted_text IS NOT NULL
+            AND (pdf_blob_key IS NOT NULL OR pdf_data IS NOT NULL)
+        """)
+        paper_ids = [row[0] for row in cursor.fetchall()]
+        print(f"📄 {len(paper_ids)} papers need page offsets")
+
+        # Load one PDF at a time to keep memory flat
+        for paper_id in paper_ids:
+            cursor.execute("SELECT arxiv_id, extracted_text FROM papers WHERE id = ?", (paper_id,))
+            arxiv_id, extracted_text = cursor.fetchone()
+            pdf_data = load_pdf(cursor, paper_id, arxiv_id)
+            if not pdf_data:
+                print(f"⚠️ {arxiv_id}: PDF is missing, skipping")
+                continue
+
+            # Papers stored before the PyMuPDF switch hold PyPDF2 text, so try both extractors
+            text, page_offsets = pdf_processor.extract_text_and_page_offsets(pdf_data)
+            if text != extracted_text:
+                text, page_offsets = pdf_processor.extract_legacy_text_and_page_offsets(pdf_data)
+            if text != extracted_text:
+                # Offsets only make sense for the exact text that was indexed
+                print(f"⚠️ {arxiv_id}: re-extracted text differs from stored text, skipping")
+                continue
+
+            cursor.execute("UPDATE papers SET page_offsets = ? WHERE id = ?", (json.dumps(page_offsets), paper_id))
+            conn.commit()
+            print(f"✅ {arxiv_id}: stored offsets for {len(page_offsets)} pages")
+    except Exception as e:
+        print(f"❌ Backfill failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+        pdf_processor.cleanup()
+
+def image_bbox(image):
+    """Crop box in PDF points; older records only have expanded_position in 200 DPI pixels"""
+    if image.get("bbox"):
+        return image["bbox"]
+    position = image.get("expanded_position")
+    if not position:
+        return None
+    scale = 72 / 200
+    return [
+        round(position["x"] * scale, 2),
+        round(position["y"] * scale, 2),
+        round((position["x"] + position["width"]) * scale, 2),
+        round((position["y"] + position["height"]) * scale, 2)
+    ]
+
+def backfill_paper_images():
+    """Index the figures of papers extracted before the paper_images table existed"""
+    from database import create_tables
+
+    # Creates paper_images (and its unique image_id index) if it is missing
+    create_tables()
+
+    db_path = "deeprxiv.db"
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            SELECT id, arxiv_id FROM papers
+            WHERE extracted_images IS NOT NULL
+            AND id NOT IN (SELECT DISTINCT paper_id FROM paper_images)
+        """)
+        papers = cursor.fetchall()
+        print(f"🖼️ {len(papers)} papers need their images indexed")
+
+        for paper_id, arxiv_id in papers:
+            cursor.execute("SELECT extracted_images FROM papers WHERE id = ?", (paper_id,))
+            try:
+                images = json.loads(cursor.fetchone()[0] or "[]")
+            except json.JSONDecodeError as e:
+                print(f"⚠️ {arxiv_id}: could not parse extracted_images ({e}), skipping")
+                continue
+
+            rows = [
+                (
+                    image["id"],
+                    paper_id,
+                    image.get("page", 0),
+                    json.dumps(image_bbox(image)) if image_bbox(image) else None,
+                    image.get("blob_key"),
+                    image.get("path"),
+                    image.get("format") or os.path.splitext(image.get("path") or "")[1].lstrip(".") or None
+                )
+                for image in images if image.get("id")
+            ]
+            cursor.executemany(
+                "INSERT OR IGNORE INTO paper_images (image_id, paper_id, page, bbox, blob_key, path, image_format, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+                rows
+            )
+            conn.commit()
+            print(f"✅ {arxiv_id}: indexed {len(rows)} images")
+    except Exception as e:
+        print(f"❌ Image backfill failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def add_active_job_index():
+    """Allow one queued or running job per paper; older duplicates of an active job are marked failed"""
+    db_path = "deeprxiv.db"
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'processing_jobs'")
+        if not cursor.fetchone():
+            print("ℹ️ Table processing_jobs does not exist yet, it will be created with the index")
+            return
+
+        # Keep the newest active job of each paper
+        cursor.execute("""
+            UPDATE processing_jobs
+            SET state = 'failed', lease_owner = NULL, lease_expires_at = NULL,
+                last_error = 'Duplicate of another active job for this paper'
+            WHERE state IN ('queued', 'running')
+            AND id NOT IN (
+                SELECT MAX(id) FROM processing_jobs WHERE state IN ('queued', 'running') GROUP BY arxiv_id
+            )
+        """)
+        if cursor.rowcount:
+            print(f"⚠️ Marked {cursor.rowcount} duplicate active jobs as failed")
+
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_processing_jobs_active_paper
+            ON processing_jobs (arxiv_id) WHERE state IN ('queued', 'running')
+        """)
+        conn.commit()
+        print("✅ processing_jobs allows one active job per paper")
+    except Exception as e:
+        print(f"❌ Job index migration failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    print("🔧 Adding missing columns to papers tables...")
+    add_missing_paper_columns()
+    print("\n🔧 Moving PDFs into the blob store...")
+    migrate_pdf_blobs()
+    print("\n🔧 Backfilling page offsets...")
+    backfill_page_offsets()
+    print("\n🔧 Indexing extracted images...")
+    backfill_paper_images()
+    print("\n🔧 Adding the active job index...")
+    add_active_job_index()
@@ -0,0 +1,190 @@
+import os
+import re
+import glob
+import time
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+ARTIFACT_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Temp files older than this were left by a writer that died before its rename
+STALE_TEMP_SECONDS = 3600
+
+class ArtifactCache:
+    """
+    Disk cache for generated artifacts such as highlighted pages and page renders.
+    Entries are keyed by their content (e.g. arxiv_id, page and a hash of the highlighted text),
+    so identical requests share one file. The cache is bounded by total bytes with
+    least-recently-used eviction, and entries older than the TTL are dropped.
+
+    Processes sharing the directory each keep their own index and adopt files written by the others
+    when they are requested. The byte cap is enforced per process over the entries it has indexed,
+    so several processes together can hold up to a multiple of max_bytes on disk.
+    """
+
+    def __init__(self, root=None, max_bytes=None, ttl_seconds=None):
+        self.root = os.path.abspath(root or os.getenv("ARTIFACT_CACHE_PATH", "deeprxiv_artifacts"))
+        self.max_bytes = max_bytes or int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+        self.ttl_seconds = ttl_seconds or int(os.getenv("ARTIFACT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+        os.makedirs(self.root, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (filename, size, created), least recently used first
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._load()
+
+    def _load(self):
+        """Index artifacts left by earlier runs, oldest first, and remove abandoned temp files."""
+        found = []
+        now = time.time()
+        for filename in os.listdir(self.root):
+            key = filename.split(".", 1)[0]
+            if not ARTIFACT_KEY_PATTERN.match(key):
+                continue
+            path = os.path.join(self.root, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if filename.endswith(".tmp"):
+                # Recent temp files may belong to a write still in progress in another process
+                if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                continue
+            found.append((stat.st_mtime, key, filename, stat.st_size))
+        for created, key, filename, size in sorted(found):
+            self._entries[key] = (filename, size, created)
+            self._bytes += size
+        with self._lock:
+            self._evict_locked()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        raw_key = "\x1f".join(str(part) for part in parts)
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+    def get_path(self, key: str) -> Optional[str]:
+        """Path of a cached artifact, or None on a miss."""
+        if not ARTIFACT_KEY_PATTERN.match(key or ""):
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                filename, size, created = entry
+                path = os.path.join(self.root, filename)
+                if time.time() - created > self.ttl_seconds:
+                    self._remove_locked(key)
+                    self.expirations += 1
+                elif os.path.exists(path):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return path
+                else:
+                    # Evicted by another worker sharing the directory
+                    self._entries.pop(key)
+                    self._bytes -= size
+            else:
+                path = self._adopt_locked(key)
+                if path:
+                    self.hits += 1
+                    return path
+            self.misses += 1
+            return None
+
+    def _adopt_locked(self, key):
+        """Index an artifact another process wrote to the shared directory, if it is on disk."""
+        for path in glob.glob(os.path.join(self.root, f"{key}.*")):
+            if path.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if time.time() - stat.st_mtime > self.ttl_seconds:
+                continue
+            self._entries[key] = (os.path.basename(path), stat.st_size, stat.st_mtime)
+            self._bytes += stat.st_size
+            self._evict_locked()
+            if key in self._entries:
+                return path
+        return None
+
+    def put(self, key: str, data: bytes, extension: str = "png") -> str:
+        """Store an artifact and return its path."""
+        filename = f"{key}.{extension}"
+        path = os.path.join(self.root, filename)
+        # Write then rename so readers never see a partial file
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (filename, len(data), time.time())
+            self._bytes += len(data)
+            self.writes += 1
+            self._evict_locked()
+        return path
+
+    def get_or_create(self, key: str, create: Callable[[], bytes], extension: str = "png") -> str:
+        """Path of the artifact, calling `create` for its bytes on a miss."""
+        path = self.get_path(key)
+        if path:
+            return path
+        return self.put(key, create(), extension)
+
+    def _remove_locked(self, key):
+        filename, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        try:
+            os.unlink(os.path.join(self.root, filename))
+        except OSError:
+            pass
+
+    def _evict_locked(self):
+        # Expired entries first, then least recently used until under budget
+        now = time.time()
+        for key in [key for key, (_, _, created) in self._entries.items() if now - created > self.ttl_seconds]:
+            self._remove_locked(key)
+            self.expirations += 1
+        while self._bytes > self.max_bytes and self._entries:
+            self._remove_locked(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": self.root,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
@@ -0,0 +1,153 @@
+import os
+import re
+import hashlib
+import importlib
+import mimetypes
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Keys are the SHA-256 of the content plus an optional extension, e.g. "9f86d0...08.png"
+BLOB_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]{1,8})?$")
+
+class BlobStore(ABC):
+    """
+    Content-addressed storage for paper PDFs, extracted figures and other generated artifacts.
+    Storing the same bytes twice returns the same key, so every worker and every restart
+    agrees on where a blob lives. Subclasses implement put, get, exists and delete.
+    """
+
+    @staticmethod
+    def make_key(data: bytes, extension: str = "") -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        extension = extension.lower().lstrip(".")
+        return f"{digest}.{extension}" if extension else digest
+
+    @staticmethod
+    def validate_key(key: str) -> str:
+        if not key or not BLOB_KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return key
+
+    @staticmethod
+    def media_type(key: str) -> str:
+        return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+    @abstractmethod
+    def put(self, data: bytes, extension: str = "") -> str:
+        """Store bytes and return their key."""
+
+    def put_stream(self, chunks, extension: str = "") -> Tuple[str, int]:
+        """Store an iterable of byte chunks and return (key, size). Backends that can should avoid buffering it whole."""
+        data = b"".join(chunks)
+        return self.put(data, extension), len(data)
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the stored bytes, or None if the key is unknown."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether a blob is stored under the key."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Remove a blob; deleting an unknown key is not an error."""
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path of a stored blob when the backend has one (lets the API use FileResponse)."""
+        return None
+
+class LocalBlobStore(BlobStore):
+    """Blobs in a local directory, sharded by the first two bytes of the hash (ab/cd/abcd...)."""
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.getenv("BLOB_STORE_PATH", "deeprxiv_blobs"))
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        self.validate_key(key)
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, data: bytes, extension: str = "") -> str:
+        key = self.make_key(data, extension)
+        path = self._path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so concurrent workers never see a partial file
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return key
+
+    def put_stream(self, chunks, extension: str = "") -> Tuple[str, int]:
+        # Hash while spooling to a temp file, then move it to the path of its key
+        os.makedirs(self.root, exist_ok=True)
+        temp_path = os.path.join(self.root, f"{uuid.uuid4().hex}.tmp")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(temp_path, "wb") as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            extension = extension.lower().lstrip(".")
+            key = f"{digest.hexdigest()}.{extension}" if extension else digest.hexdigest()
+            path = self._path(key)
+            if os.path.exists(path):
+                os.unlink(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return key, size
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete(self, key: str):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+_blob_store = None
+_blob_store_lock = threading.Lock()
+
+def get_blob_store() -> BlobStore:
+    """
+    Process-wide blob store. BLOB_STORE_BACKEND is "local" (default) or "module:ClassName"
+    for any BlobStore subclass that can be constructed without arguments.
+    """
+    global _blob_store
+    with _blob_store_lock:
+        if _blob_store is None:
+            backend = os.getenv("BLOB_STORE_BACKEND", "local")
+            if backend == "local":
+                _blob_store = LocalBlobStore()
+            else:
+                module_name, _, class_name = backend.partition(":")
+                _blob_store = getattr(importlib.import_module(module_name), class_name)()
+            print(f"Blob store: {type(_blob_store).__name__}")
+        return _blob_store
@@ -17,7 +17,7 @@ def check_paper_status(arxiv_id):
             
         print(f"📄 Paper found: {paper.title or 'No title'}")
         print(f"✅ Processed: {paper.processed}")
-        print(f"📝 Has PDF data: {bool(paper.pdf_data)}")
+        print(f"📝 Has PDF data: {bool(paper.pdf_blob_key or paper.pdf_data)}")
         print(f"📊 Text length: {len(paper.extracted_text) if paper.extracted_text else 0}")
         print(f"🗂️ Has sections: {bool(paper.sections_data)}")
         
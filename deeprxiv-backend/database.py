@@ -1,6 +1,6 @@
-from sqlalchemy import create_engine, Column, Integer, String, LargeBinary, JSON, Text, Boolean, DateTime, ForeignKey, Float, Index
+from sqlalchemy import create_engine, Column, Integer, String, LargeBinary, JSON, Text, Boolean, DateTime, ForeignKey, Float, Index, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, deferred
 import os
 from dotenv import load_dotenv
 from datetime import datetime
@@ -34,17 +34,67 @@ class Paper(Base):
     authors = Column(String, nullable=True)
     abstract = Column(Text, nullable=True)
     pdf_url = Column(String, nullable=True)
-    pdf_data = Column(LargeBinary, nullable=True)
+    pdf_data = deferred(Column(LargeBinary, nullable=True))  # Legacy in-row PDF, only loaded when accessed
+    pdf_blob_key = Column(String, nullable=True)  # PDF file in the blob store
+    pdf_size = Column(Integer, nullable=True)
+    pdf_sha256 = Column(String, nullable=True)
     extracted_text = Column(Text, nullable=True)
+    page_offsets = Column(Text, nullable=True)  # JSON array: start offset of each page in extracted_text
     extracted_images = Column(Text, nullable=True)  # JSON string of image data
     sections_data = Column(Text, nullable=True)  # JSON string of sections and subsections
     processed = Column(Boolean, default=False)
+    content_indexed = Column(Boolean, default=False)  # Extracted text is searchable (set before sections are generated)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     chat_sessions = relationship("ChatSession", back_populates="paper")
     analytics = relationship("PaperAnalytics", back_populates="paper")
+    figures = relationship("PaperImage", back_populates="paper", cascade="all, delete-orphan")
+
+class PaperImage(Base):
+    __tablename__ = "paper_images"
+
+    id = Column(Integer, primary_key=True, index=True)
+    image_id = Column(String, unique=True, index=True, nullable=False)
+    paper_id = Column(Integer, ForeignKey("papers.id"), nullable=False, index=True)
+    page = Column(Integer, nullable=False)  # 0-indexed page number
+    bbox = Column(Text, nullable=True)  # JSON [x0, y0, x1, y1] of the crop in PDF points
+    blob_key = Column(String, nullable=True)  # Content-addressed key in the blob store
+    path = Column(String, nullable=True)  # Local file path (figures extracted before the blob store)
+    image_format = Column(String, nullable=True)  # "png", "jpg" or "webp"
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Relationships
+    paper = relationship("Paper", back_populates="figures")
+
+class ProcessingJob(Base):
+    __tablename__ = "processing_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_type = Column(String, nullable=False, default="process_paper")
+    arxiv_id = Column(String, nullable=False, index=True)
+    state = Column(String, nullable=False, default="queued")  # "queued", "running", "succeeded", "failed"
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    lease_owner = Column(String, nullable=True)  # Worker currently holding the job
+    lease_expires_at = Column(DateTime, nullable=True)  # Running jobs past this are reclaimed by other workers
+    progress = Column(String, nullable=True)  # Latest status message from the worker
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    # Workers look for queued jobs and expired leases; a paper has at most one queued or running job
+    __table_args__ = (
+        Index('idx_processing_jobs_state', 'state', 'lease_expires_at'),
+        Index(
+            'idx_processing_jobs_active_paper', 'arxiv_id', unique=True,
+            sqlite_where=text("state IN ('queued', 'running')"),
+            postgresql_where=text("state IN ('queued', 'running')")
+        ),
+    )
 
 class User(Base):
     __tablename__ = "users"
@@ -0,0 +1,315 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from google import genai
+from google.genai.types import EmbedContentConfig
+
+# Load environment variables
+load_dotenv('.env.local')
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_DIMENSIONS = 768
+
+class EmbeddingCache:
+    """
+    Persistent SQLite cache of embeddings keyed by model, task type, dimensionality,
+    title and a SHA-256 of the text. Entries are evicted least-recently-used first
+    once the stored vectors exceed `max_bytes`.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or os.getenv("EMBEDDING_CACHE_PATH", "deeprxiv_embedding_cache.db")
+        self.max_bytes = max_bytes or int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        # Hits only rewrite an entry's LRU timestamp once it is older than this
+        self.touch_seconds = float(os.getenv("EMBEDDING_CACHE_TOUCH_SECONDS", "3600"))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        # One shared connection guarded by a lock; WAL lets reindex scripts and the API share the file
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+
+        # The cache file is shared by the API, workers and scripts, so the size budget is kept in the
+        # file itself: triggers maintain one total row that every process reads inside its write transaction
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache_totals (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO cache_totals (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM embeddings")
+        self._conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS embeddings_size_insert AFTER INSERT ON embeddings
+            BEGIN UPDATE cache_totals SET bytes = bytes + NEW.size WHERE id = 0; END
+        """)
+        self._conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS embeddings_size_delete AFTER DELETE ON embeddings
+            BEGIN UPDATE cache_totals SET bytes = bytes - OLD.size WHERE id = 0; END
+        """)
+        self._conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS embeddings_size_update AFTER UPDATE OF size ON embeddings
+            BEGIN UPDATE cache_totals SET bytes = bytes + NEW.size - OLD.size WHERE id = 0; END
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, task_type, dimensionality, title, text) -> str:
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        raw_key = "\x1f".join([model, task_type, str(dimensionality), title or "", text_hash])
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """
+        Return cached vectors for the given keys and refresh their LRU position. Entries touched within
+        the last EMBEDDING_CACHE_TOUCH_SECONDS are not rewritten, so repeated hits stay read-only.
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            now = time.time()
+            stale = []
+            try:
+                # Stay well below SQLite's bound-parameter limit
+                for start in range(0, len(unique_keys), 500):
+                    batch = unique_keys[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._conn.execute(
+                        f"SELECT key, vector, last_access FROM embeddings WHERE key IN ({placeholders})", batch
+                    ).fetchall()
+                    for key, vector, last_access in rows:
+                        values = array("f")
+                        values.frombytes(vector)
+                        found[key] = values.tolist()
+                        if now - last_access > self.touch_seconds:
+                            stale.append(key)
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                print(f"⚠️ Embedding cache read failed: {str(e)}")
+                found, stale = {}, []
+
+            if stale:
+                try:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(now, key) for key in stale]
+                    )
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    # The vectors already read are still good; only their LRU refresh is lost
+                    self._conn.rollback()
+                    print(f"⚠️ Embedding cache touch failed: {str(e)}")
+
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def get(self, key: str) -> Optional[List[float]]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, entries: Dict[str, List[float]]):
+        """Store vectors and evict the least recently used entries if over budget."""
+        if not entries:
+            return
+        now = time.time()
+        rows = []
+        for key, values in entries.items():
+            vector = array("f", values).tobytes()
+            rows.append((key, vector, len(vector), now))
+
+        with self._lock:
+            try:
+                # Take the write lock up front so the total read during eviction is current across processes
+                self._conn.execute("BEGIN IMMEDIATE")
+                # An upsert (not INSERT OR REPLACE) so the size triggers see overwrites
+                self._conn.executemany(
+                    "INSERT INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET vector = excluded.vector, size = excluded.size, "
+                    "last_access = excluded.last_access",
+                    rows
+                )
+                self.writes += len(rows)
+                self._evict_locked()
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                print(f"⚠️ Embedding cache write failed: {str(e)}")
+
+    def put(self, key: str, values: List[float]):
+        self.put_many({key: values})
+
+    def _total_bytes(self):
+        return self._conn.execute("SELECT bytes FROM cache_totals WHERE id = 0").fetchone()[0]
+
+    def _evict_locked(self):
+        # Runs inside put_many's write transaction, so the total includes other processes' writes
+        while self._total_bytes() > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key FROM embeddings ORDER BY last_access LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", rows)
+            self.evictions += len(rows)
+
+    def stats(self):
+        """Hit/miss counters for this process plus the current size of the cache."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "bytes": self._total_bytes(),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions
+            }
+
+class EmbeddingService:
+    def __init__(self, api_key=None, batch_size=None, max_concurrency=None, cache=None):
+        # Google GenAI is only used for embeddings
+        self.client = genai.Client(api_key=api_key or os.environ.get("GEMINI_API_KEY"))
+        self.model = EMBEDDING_MODEL
+        self.task_type = "RETRIEVAL_DOCUMENT"
+        self.output_dimensionality = EMBEDDING_DIMENSIONS
+
+        # Chunks sent per embed_content call and batches kept in flight at once
+        self.batch_size = batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", "50"))
+        self.max_concurrency = max_concurrency or int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+
+        # Persistent cache shared with the reindex scripts; disable with EMBEDDING_CACHE_ENABLED=false
+        if cache is None and os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() != "false":
+            try:
+                cache = EmbeddingCache()
+            except Exception as e:
+                print(f"⚠️ Embedding cache unavailable: {str(e)}")
+        self.cache = cache
+
+    def _config(self, title):
+        return EmbedContentConfig(
+            task_type=self.task_type,
+            output_dimensionality=self.output_dimensionality,
+            title=title,
+        )
+
+    def _cache_key(self, text, title):
+        return EmbeddingCache.make_key(self.model, self.task_type, self.output_dimensionality, title, text)
+
+    def get_embedding(self, text: str, title="DeepRxiv Paper") -> List[float]:
+        """Generate a single embedding using Google's text-embedding-004 model."""
+        key = self._cache_key(text, title) if self.cache else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        values = self._embed_uncached(text, title)
+        if key:
+            self.cache.put(key, values)
+        return values
+
+    def _embed_uncached(self, text: str, title: str) -> List[float]:
+        response = self.client.models.embed_content(
+            model=self.model,
+            contents=text,
+            config=self._config(title),
+        )
+        return response.embeddings[0].values
+
+    def cache_stats(self):
+        if not self.cache:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
+
+    def get_embeddings_batch(self, items: List[Tuple[str, str]]) -> List[Optional[List[float]]]:
+        """
+        Generate embeddings for a list of (text, title) pairs.
+        Chunks sharing a title are sent together in batches of `batch_size`, and up to
+        `max_concurrency` batches run at once. The result list matches the input order;
+        chunks that could not be embedded come back as None.
+        """
+        results = [None] * len(items)
+        if not items:
+            return results
+
+        # Serve whatever we can from the cache and only send the misses to the API
+        keys = [self._cache_key(text, title) for text, title in items] if self.cache else None
+        if keys:
+            cached = self.cache.get_many(keys)
+            for index, key in enumerate(keys):
+                results[index] = cached.get(key)
+            print(f"🗄️ Embedding cache: {len(cached)} of {len(items)} chunks already embedded")
+
+        # The title is part of the request config, so only chunks with the same title can share a call
+        indices_by_title = {}
+        for index, (_, title) in enumerate(items):
+            if results[index] is None:
+                indices_by_title.setdefault(title, []).append(index)
+
+        batches = []
+        for title, indices in indices_by_title.items():
+            for start in range(0, len(indices), self.batch_size):
+                batches.append((title, indices[start:start + self.batch_size]))
+
+        if not batches:
+            return results
+
+        pending = sum(len(indices) for _, indices in batches)
+        print(f"🔤 Generating {pending} embeddings in {len(batches)} batches (concurrency {self.max_concurrency})")
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+            futures = {
+                executor.submit(self._embed_batch, [items[i][0] for i in indices], title): indices
+                for title, indices in batches
+            }
+            for future in as_completed(futures):
+                indices = futures[future]
+                new_entries = {}
+                for index, values in zip(indices, future.result()):
+                    results[index] = values
+                    if keys and values is not None:
+                        new_entries[keys[index]] = values
+                if new_entries:
+                    self.cache.put_many(new_entries)
+
+        succeeded = sum(1 for values in results if values is not None)
+        print(f"✅ Generated {succeeded}/{len(items)} embeddings")
+        return results
+
+    def _embed_batch(self, texts: List[str], title: str) -> List[Optional[List[float]]]:
+        """Embed one batch, falling back to per-chunk calls so a bad chunk only drops itself."""
+        try:
+            response = self.client.models.embed_content(
+                model=self.model,
+                contents=texts,
+                config=self._config(title),
+            )
+            return [embedding.values for embedding in response.embeddings]
+        except Exception as e:
+            print(f"⚠️ Batch of {len(texts)} embeddings failed ({str(e)}), retrying chunks individually")
+
+        values = []
+        for text in texts:
+            try:
+                values.append(self._embed_uncached(text, title))
+            except Exception as e:
+                print(f"❌ Error generating embedding: {str(e)}")
+                values.append(None)
+        return values
@@ -0,0 +1,172 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from database import SessionLocal, ProcessingJob
+
+# Load environment variables
+load_dotenv()
+
+# A running job whose worker has not renewed its lease for this long is handed to another worker
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+ACTIVE_STATES = ("queued", "running")
+
+def make_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def _active_job(db: Session, arxiv_id: str) -> Optional[ProcessingJob]:
+    return (
+        db.query(ProcessingJob)
+        .filter(ProcessingJob.arxiv_id == arxiv_id, ProcessingJob.state.in_(ACTIVE_STATES))
+        .first()
+    )
+
+def enqueue_paper_job(db: Session, arxiv_id: str) -> ProcessingJob:
+    """
+    Queue processing of a paper, unless a job for it is already queued or running.
+    The idx_processing_jobs_active_paper unique index settles concurrent requests for the same paper.
+    """
+    job = _active_job(db, arxiv_id)
+    if job:
+        return job
+
+    job = ProcessingJob(job_type="process_paper", arxiv_id=arxiv_id, state="queued", max_attempts=JOB_MAX_ATTEMPTS)
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another request queued the paper between the check and the insert
+        db.rollback()
+        return _active_job(db, arxiv_id)
+    db.refresh(job)
+    print(f"📥 Queued processing job {job.id} for paper {arxiv_id}")
+    return job
+
+def latest_job(db: Session, arxiv_id: str) -> Optional[ProcessingJob]:
+    return (
+        db.query(ProcessingJob)
+        .filter(ProcessingJob.arxiv_id == arxiv_id)
+        .order_by(ProcessingJob.created_at.desc(), ProcessingJob.id.desc())
+        .first()
+    )
+
+def _expired_lease(now):
+    return and_(ProcessingJob.state == "running", ProcessingJob.lease_expires_at < now)
+
+def claim_job(db: Session, worker_id: str) -> Optional[ProcessingJob]:
+    """
+    Lease the oldest queued job, or a running job whose lease expired because its worker died.
+    Claiming is a conditional UPDATE, so when workers race for the same job only one of them gets it.
+    """
+    now = datetime.utcnow()
+
+    # Jobs that keep killing their worker are not retried forever
+    exhausted = db.query(ProcessingJob).filter(
+        _expired_lease(now), ProcessingJob.attempts >= ProcessingJob.max_attempts
+    ).update({
+        ProcessingJob.state: "failed",
+        ProcessingJob.lease_owner: None,
+        ProcessingJob.lease_expires_at: None,
+        ProcessingJob.finished_at: now,
+        ProcessingJob.last_error: "Lease expired on the last attempt"
+    }, synchronize_session=False)
+    if exhausted:
+        print(f"⚠️ Marked {exhausted} stalled jobs as failed after their last attempt")
+    db.commit()
+
+    claimable = or_(ProcessingJob.state == "queued", _expired_lease(now))
+    candidates = (
+        db.query(ProcessingJob.id)
+        .filter(claimable)
+        .order_by(ProcessingJob.created_at, ProcessingJob.id)
+        .limit(5)
+        .all()
+    )
+    for (job_id,) in candidates:
+        claimed = db.query(ProcessingJob).filter(ProcessingJob.id == job_id, claimable).update({
+            ProcessingJob.state: "running",
+            ProcessingJob.lease_owner: worker_id,
+            ProcessingJob.lease_expires_at: now + timedelta(seconds=JOB_LEASE_SECONDS),
+            ProcessingJob.attempts: ProcessingJob.attempts + 1,
+            ProcessingJob.started_at: now,
+            ProcessingJob.progress: "Starting"
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+    return None
+
+def _owned_job(db: Session, job_id: int, worker_id: str):
+    return db.query(ProcessingJob).filter(
+        ProcessingJob.id == job_id,
+        ProcessingJob.lease_owner == worker_id,
+        ProcessingJob.state == "running"
+    )
+
+def renew_lease(db: Session, job_id: int, worker_id: str) -> bool:
+    """Extend a running job's lease. False if the job was reclaimed by another worker."""
+    renewed = _owned_job(db, job_id, worker_id).update({
+        ProcessingJob.lease_expires_at: datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)
+    }, synchronize_session=False)
+    db.commit()
+    return renewed == 1
+
+def complete_job(db: Session, job_id: int, worker_id: str):
+    _owned_job(db, job_id, worker_id).update({
+        ProcessingJob.state: "succeeded",
+        ProcessingJob.lease_owner: None,
+        ProcessingJob.lease_expires_at: None,
+        ProcessingJob.finished_at: datetime.utcnow(),
+        ProcessingJob.progress: "Completed"
+    }, synchronize_session=False)
+    db.commit()
+
+def fail_job(db: Session, job_id: int, worker_id: str, error: str):
+    """Record a failed attempt; the job is queued again until it runs out of attempts."""
+    job = _owned_job(db, job_id, worker_id).first()
+    if not job:
+        return
+    job.last_error = error
+    job.lease_owner = None
+    job.lease_expires_at = None
+    if job.attempts < job.max_attempts:
+        job.state = "queued"
+        print(f"🔁 Job {job.id} for {job.arxiv_id} failed (attempt {job.attempts}/{job.max_attempts}), requeued")
+    else:
+        job.state = "failed"
+        job.finished_at = datetime.utcnow()
+        print(f"❌ Job {job.id} for {job.arxiv_id} failed after {job.attempts} attempts")
+    db.commit()
+
+class JobProgress(dict):
+    """
+    Progress dict that workers pass to paper_pipeline.process_paper. Status messages are also written
+    to the job while this worker holds its lease, where the API's status endpoint reads them.
+    """
+
+    def __init__(self, job_id: int, worker_id: str):
+        super().__init__()
+        self.job_id = job_id
+        self.worker_id = worker_id
+
+    def __setitem__(self, arxiv_id, message):
+        super().__setitem__(arxiv_id, message)
+        db = SessionLocal()
+        try:
+            # A job reclaimed by another worker keeps that worker's progress
+            _owned_job(db, self.job_id, self.worker_id).update(
+                {ProcessingJob.progress: str(message)[:500]}, synchronize_session=False
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error saving job progress for {arxiv_id}: {str(e)}")
+        finally:
+            db.close()
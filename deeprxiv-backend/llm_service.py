@@ -1,19 +1,53 @@
 import os
+import time
 import requests
+import httpx
+from requests.adapters import HTTPAdapter
 import json
 from dotenv import load_dotenv
 import re
-from typing import Dict, Any, List, Generator, Optional
+from dataclasses import dataclass, replace
+from typing import Dict, Any, List, Generator, Optional, Union
 
 # Load environment variables
 load_dotenv()
 
+# Returned by _parse_stream_line for the [DONE] event
+STREAM_DONE = object()
+
+# Attempts per section/subsection content call, with exponential backoff between them
+SECTION_CONTENT_ATTEMPTS = int(os.getenv("SECTION_CONTENT_ATTEMPTS", "3"))
+SECTION_CONTENT_RETRY_DELAY = float(os.getenv("SECTION_CONTENT_RETRY_DELAY", "2"))
+
+@dataclass(frozen=True)
+class ModelConfig:
+    """
+    Model and sampling settings for one Perplexity call. Immutable, so each request carries its own
+    and concurrent requests never see each other's choice of model.
+    """
+    model: str = "sonar"
+    temperature: float = 0.2
+    top_p: float = 0.9
+    reasoning: bool = False  # Response may contain <think> chain of thought
+    timeout: Optional[float] = None  # Read timeout in seconds, None for the service default
+
 class LLMService:
     def __init__(self):
         # Initialize Perplexity API only
         self.api_url = "https://api.perplexity.ai/chat/completions"
         self.perplexity_api_key = os.getenv("PERPLEXITY_API_KEY")
-        self.model = "sonar"  # Default model
+        self.default_model = "sonar"
+        
+        # Pooled keep-alive connections: a requests session for blocking callers (paper processing)
+        # and an httpx.AsyncClient for async request handlers
+        self.timeout = float(os.getenv("PERPLEXITY_TIMEOUT_SECONDS", "120"))
+        self.connect_timeout = float(os.getenv("PERPLEXITY_CONNECT_TIMEOUT_SECONDS", "10"))
+        self.max_connections = int(os.getenv("PERPLEXITY_MAX_CONNECTIONS", "20"))
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.max_connections
+        ))
+        self._async_client = None
         
         # Available Perplexity models
         self.available_models = {
@@ -47,15 +81,22 @@ class LLMService:
             }
         }
         
+        self.default_config = self.model_config()
+        
         if not self.perplexity_api_key:
             print("WARNING: PERPLEXITY_API_KEY environment variable not set!")
     
-    def set_model(self, model: str):
-        """Set the model to use for API calls."""
-        if model in self.available_models:
-            self.model = model
-        else:
+    def model_config(self, model: Optional[str] = None, **overrides) -> ModelConfig:
+        """Validated config for a call with the given model (the default model if None)."""
+        model = model or self.default_model
+        if model not in self.available_models:
             raise ValueError(f"Model {model} not available. Available models: {list(self.available_models.keys())}")
+        config = ModelConfig(model=model, reasoning=self.available_models[model]["type"] == "Reasoning")
+        return replace(config, **overrides) if overrides else config
+    
+    def _resolve_config(self, model: Union[str, ModelConfig, None], timeout=None) -> ModelConfig:
+        config = model if isinstance(model, ModelConfig) else (self.model_config(model) if model else self.default_config)
+        return replace(config, timeout=timeout) if timeout else config
     
     def get_available_models(self):
         """Get list of available models with their descriptions."""
@@ -82,16 +123,10 @@ class LLMService:
         
         return content
 
-    def _call_perplexity_api(self, prompt, system_prompt="Be precise and concise.", model=None, stream=False):
-        """
-        Makes a call to the Perplexity API with the given prompt.
-        Returns the response text and citations.
-        Supports streaming if stream=True.
-        """
-        current_model = model or self.model
-        
+    def _build_request(self, prompt, system_prompt, config, stream):
+        """Headers and JSON payload of a Perplexity chat completion request."""
         print(f"\n🚀 PERPLEXITY API CALL")
-        print(f"Model: {current_model}")
+        print(f"Model: {config.model}")
         print(f"Stream: {stream}")
         print(f"System prompt: {system_prompt[:100]}...")
         print(f"User prompt length: {len(prompt)} characters")
@@ -103,7 +138,7 @@ class LLMService:
         }
         
         payload = {
-            "model": current_model,
+            "model": config.model,
             "messages": [
                 {
                     "role": "system",
@@ -117,140 +152,244 @@ class LLMService:
             "stream": stream,
             "return_images": True,
             "return_related_questions": False,
-            "temperature": 0.2,
-            "top_p": 0.9
+            "temperature": config.temperature,
+            "top_p": config.top_p
         }
+        return headers, payload
+    
+    def _parse_completion(self, response_data, model):
+        """Content, citations and images of a non-streaming response."""
+        content = response_data["choices"][0]["message"]["content"]
+        
+        # Extract citations if available
+        citations = response_data.get("citations", [])
+        
+        # Extract images if available (new feature)
+        images = response_data.get("images", [])
         
+        print(f"✅ Perplexity response received:")
+        print(f"Content length: {len(content)} characters")
+        print(f"Citations count: {len(citations)}")
+        print(f"Images count: {len(images)}")
+        print(f"Response preview: {content[:300]}...")
+        
+        return {
+            "content": content,
+            "citations": citations,
+            "images": images,
+            "model_used": model
+        }
+    
+    def _error_result(self, error, model, response=None):
+        print(f"❌ Error calling Perplexity API: {str(error)}")
+        if response is not None:
+            print(f"Response text: {response.text}")
+            print(f"Status code: {response.status_code}")
+        return {
+            "content": f"Error: {str(error)}",
+            "citations": [],
+            "images": [],
+            "model_used": model,
+            "error": str(error)
+        }
+    
+    def _call_perplexity_api(self, prompt, system_prompt="Be precise and concise.", model=None, stream=False, timeout=None):
+        """
+        Makes a call to the Perplexity API with the given prompt.
+        Returns the response text and citations.
+        Supports streaming if stream=True.
+        `model` is a model name or a ModelConfig; the service default is used if None.
+        Blocking; async handlers should await _call_perplexity_api_async instead.
+        """
+        config = self._resolve_config(model, timeout)
+        current_model = config.model
+        headers, payload = self._build_request(prompt, system_prompt, config, stream)
+        timeout = config.timeout or self.timeout
+        
+        response = None
         try:
             print(f"📡 Sending request to Perplexity...")
             
             if stream:
-                return self._handle_streaming_response(headers, payload)
-            else:
-                response = requests.post(self.api_url, json=payload, headers=headers)
-                response.raise_for_status()
-                
-                response_data = response.json()
-                content = response_data["choices"][0]["message"]["content"]
-                
-                # Extract citations if available
-                citations = response_data.get("citations", [])
-                
-                # Extract images if available (new feature)
-                images = response_data.get("images", [])
-                
-                print(f"✅ Perplexity response received:")
-                print(f"Content length: {len(content)} characters")
-                print(f"Citations count: {len(citations)}")
-                print(f"Images count: {len(images)}")
-                print(f"Response preview: {content[:300]}...")
-                
-                return {
-                    "content": content,
-                    "citations": citations,
-                    "images": images,
-                    "model_used": current_model
-                }
+                return self._handle_streaming_response(headers, payload, timeout)
+            
+            response = self.session.post(self.api_url, json=payload, headers=headers, timeout=(self.connect_timeout, timeout))
+            response.raise_for_status()
+            return self._parse_completion(response.json(), current_model)
         except Exception as e:
-            print(f"❌ Error calling Perplexity API: {str(e)}")
-            if 'response' in locals() and hasattr(response, 'text'):
-                print(f"Response text: {response.text}")
-            if 'response' in locals() and hasattr(response, 'status_code'):
-                print(f"Status code: {response.status_code}")
-            return {
-                "content": f"Error: {str(e)}",
-                "citations": [],
-                "images": [],
-                "model_used": current_model
-            }
+            return self._error_result(e, current_model, response)
     
-    def _handle_streaming_response(self, headers, payload):
+    def _handle_streaming_response(self, headers, payload, timeout=None):
         """Handle streaming response from Perplexity API."""
         try:
-            response = requests.post(self.api_url, json=payload, headers=headers, stream=True)
+            response = self.session.post(
+                self.api_url, json=payload, headers=headers, stream=True,
+                timeout=(self.connect_timeout, timeout or self.timeout)
+            )
             response.raise_for_status()
             
             def generate_chunks():
-                citations = []
-                images = []
-                model_used = payload["model"]
-                full_response_data = None
-                
-                for line in response.iter_lines():
-                    if line:
-                        line = line.decode('utf-8')
-                        if line.startswith('data: '):
-                            line = line[6:]  # Remove 'data: ' prefix
-                            
-                            if line.strip() == '[DONE]':
+                stream_state = {"citations": [], "images": [], "last_chunk": None}
+                with response:
+                    for line in response.iter_lines():
+                        if line:
+                            chunk = self._parse_stream_line(line.decode('utf-8'), stream_state)
+                            if chunk is STREAM_DONE:
                                 break
-                                
-                            try:
-                                chunk_data = json.loads(line)
-                                
-                                # Store the full response data for final metadata extraction
-                                full_response_data = chunk_data
-                                
-                                # Extract content delta
-                                if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                                    delta = chunk_data['choices'][0].get('delta', {})
-                                    content = delta.get('content', '')
-                                    
-                                    if content:
-                                        yield {
-                                            "type": "content",
-                                            "content": content
-                                        }
-                                
-                                # Extract metadata from any chunk that has it
-                                if 'citations' in chunk_data:
-                                    citations = chunk_data['citations']
-                                if 'images' in chunk_data:
-                                    images = chunk_data['images']
-                                    
-                            except json.JSONDecodeError:
-                                continue
-                
-                # Extract final metadata from the complete response
-                if full_response_data:
-                    # Try to get citations and images from the final response
-                    if 'citations' in full_response_data:
-                        citations = full_response_data['citations']
-                    if 'images' in full_response_data:
-                        images = full_response_data['images']
-                    
-                    # Also check in the message content for citations
-                    if 'choices' in full_response_data and len(full_response_data['choices']) > 0:
-                        message = full_response_data['choices'][0].get('message', {})
-                        if 'citations' in message:
-                            citations = message['citations']
-                        if 'images' in message:
-                            images = message['images']
-                
-                print(f"🔍 Final streaming metadata: {len(citations)} citations, {len(images)} images")
-                
-                # Yield final metadata
-                yield {
-                    "type": "metadata",
-                    "citations": citations,
-                    "images": images,
-                    "model_used": model_used
-                }
+                            if chunk:
+                                yield chunk
+                yield self._stream_metadata(stream_state, payload["model"])
             
             return generate_chunks()
             
         except Exception as e:
             print(f"❌ Error in streaming response: {str(e)}")
+            error_chunk = self._stream_error(e, payload["model"])
             def error_generator():
-                yield {
-                    "type": "error",
-                    "content": f"Error: {str(e)}",
-                    "citations": [],
-                    "images": [],
-                    "model_used": payload["model"]
-                }
+                yield error_chunk
             return error_generator()
     
+    async def _call_perplexity_api_async(self, prompt, system_prompt="Be precise and concise.", model=None, stream=False, timeout=None):
+        """
+        Same as _call_perplexity_api but on the shared pooled httpx.AsyncClient, so a handler
+        awaiting it does not block the event loop. With stream=True returns an async generator
+        of the same chunks as the blocking version.
+        """
+        config = self._resolve_config(model, timeout)
+        current_model = config.model
+        headers, payload = self._build_request(prompt, system_prompt, config, stream)
+        timeout = httpx.Timeout(config.timeout or self.timeout, connect=self.connect_timeout)
+        
+        if stream:
+            return self._stream_async(headers, payload, timeout)
+        
+        response = None
+        try:
+            print(f"📡 Sending request to Perplexity...")
+            response = await self._get_async_client().post(self.api_url, json=payload, headers=headers, timeout=timeout)
+            response.raise_for_status()
+            return self._parse_completion(response.json(), current_model)
+        except Exception as e:
+            return self._error_result(e, current_model, response)
+    
+    async def _stream_async(self, headers, payload, timeout):
+        """Async generator over a streaming Perplexity response."""
+        stream_state = {"citations": [], "images": [], "last_chunk": None}
+        try:
+            print(f"📡 Sending streaming request to Perplexity...")
+            async with self._get_async_client().stream(
+                "POST", self.api_url, json=payload, headers=headers, timeout=timeout
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line:
+                        chunk = self._parse_stream_line(line, stream_state)
+                        if chunk is STREAM_DONE:
+                            break
+                        if chunk:
+                            yield chunk
+        except Exception as e:
+            print(f"❌ Error in streaming response: {str(e)}")
+            yield self._stream_error(e, payload["model"])
+            return
+        yield self._stream_metadata(stream_state, payload["model"])
+    
+    def _get_async_client(self):
+        # Created on first use so it binds to the server's event loop
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout)
+            )
+        return self._async_client
+    
+    async def aclose(self):
+        """Close the pooled async client (on application shutdown)."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+    
+    def _parse_stream_line(self, line, stream_state):
+        """
+        Parse one server-sent event line. Returns a content chunk, None for lines without content,
+        or STREAM_DONE at the end of the stream. Citations and images are collected in stream_state.
+        """
+        if not line.startswith('data: '):
+            return None
+        line = line[6:]  # Remove 'data: ' prefix
+        
+        if line.strip() == '[DONE]':
+            return STREAM_DONE
+        
+        try:
+            chunk_data = json.loads(line)
+        except json.JSONDecodeError:
+            return None
+        
+        # Store the full response data for final metadata extraction
+        stream_state["last_chunk"] = chunk_data
+        
+        # Extract metadata from any chunk that has it
+        if 'citations' in chunk_data:
+            stream_state["citations"] = chunk_data['citations']
+        if 'images' in chunk_data:
+            stream_state["images"] = chunk_data['images']
+        
+        # Extract content delta
+        if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
+            delta = chunk_data['choices'][0].get('delta', {})
+            content = delta.get('content', '')
+            
+            if content:
+                return {
+                    "type": "content",
+                    "content": content
+                }
+        return None
+    
+    def _stream_metadata(self, stream_state, model_used):
+        """Final metadata chunk of a stream."""
+        citations = stream_state["citations"]
+        images = stream_state["images"]
+        full_response_data = stream_state["last_chunk"]
+        
+        # Extract final metadata from the complete response
+        if full_response_data:
+            # Try to get citations and images from the final response
+            if 'citations' in full_response_data:
+                citations = full_response_data['citations']
+            if 'images' in full_response_data:
+                images = full_response_data['images']
+            
+            # Also check in the message content for citations
+            if 'choices' in full_response_data and len(full_response_data['choices']) > 0:
+                message = full_response_data['choices'][0].get('message', {})
+                if 'citations' in message:
+                    citations = message['citations']
+                if 'images' in message:
+                    images = message['images']
+        
+        print(f"🔍 Final streaming metadata: {len(citations)} citations, {len(images)} images")
+        
+        return {
+            "type": "metadata",
+            "citations": citations,
+            "images": images,
+            "model_used": model_used
+        }
+    
+    def _stream_error(self, error, model_used):
+        return {
+            "type": "error",
+            "content": f"Error: {str(error)}",
+            "citations": [],
+            "images": [],
+            "model_used": model_used
+        }
+    
     def _extract_chain_of_thought(self, content: str) -> tuple[str, str]:
         """
         Extract chain of thought reasoning from sonar-reasoning models.
@@ -576,11 +715,13 @@ class LLMService:
                 "images": []
             }
     
-    def generate_section_content(self, paper_text, section_title, section_content):
+    def generate_section_content(self, paper_text, section_title, section_content, attempts=None):
         """
         Generate detailed content for a specific section or subsection.
         Uses the section title and existing content as context.
-        Returns the content and citations.
+        Returns the content and citations; failed API calls are retried up to `attempts` times,
+        and if all fail the result carries an "error" key.
+        Thread-safe, so several sections can be generated concurrently.
         """
         system_prompt = """
         You are an expert academic research educator and technical writer.
@@ -731,8 +872,18 @@ class LLMService:
         """
         
         print(f"Generating content for section/subsection: {section_title}")
+        attempts = attempts or SECTION_CONTENT_ATTEMPTS
         try:
-            result = self._call_perplexity_api(prompt, system_prompt, model="sonar-reasoning-pro")
+            for attempt in range(1, attempts + 1):
+                result = self._call_perplexity_api(prompt, system_prompt, model="sonar-reasoning-pro")
+                if not result.get("error"):
+                    break
+                if attempt == attempts:
+                    raise RuntimeError(result["error"])
+                delay = SECTION_CONTENT_RETRY_DELAY * 2 ** (attempt - 1)
+                print(f"⚠️ Attempt {attempt}/{attempts} for '{section_title}' failed, retrying in {delay:.0f}s")
+                time.sleep(delay)
+            
             content = result["content"]
             citations = result["citations"]
             images = result.get("images", [])  # Get web images from Perplexity
@@ -755,7 +906,8 @@ class LLMService:
             return {
                 "content": f"Content generation for section '{section_title}' failed due to: {str(e)}",
                 "citations": [],
-                "images": []
+                "images": [],
+                "error": str(e)
             }
 
     def _sanitize_json_string(self, json_str: str) -> str:
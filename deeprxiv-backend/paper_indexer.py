@@ -0,0 +1,307 @@
+import os
+import hashlib
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+
+# Raw-text chunking for the vector index
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "2000"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "0"))
+CHARS_PER_TOKEN = 4
+
+# The vector index: a Chroma server when CHROMA_HOST is set, otherwise a local directory. A local
+# PersistentClient directory is not safe for several writer processes, so it limits workers to one per host
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+CHROMA_PATH = os.getenv("CHROMA_PATH", "deeprxiv_chroma_db")
+
+def make_chroma_client():
+    import chromadb
+    if CHROMA_HOST:
+        return chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    return chromadb.PersistentClient(path=CHROMA_PATH)
+
+# Sentence ends we prefer to cut at, searched only near the end of each chunk
+SENTENCE_BREAKS = (". ", "? ", "! ", ".\n", "?\n", "!\n", "\n\n")
+
+def split_content_by_tokens(content, max_tokens=2000, chars_per_token=4):
+    """Fast and reliable content chunking by character count."""
+    # Normalize newlines to spaces and remove multiple spaces
+    normalized_content = content.replace('\n', ' ').replace('\r', ' ')
+    normalized_content = ' '.join(normalized_content.split())
+
+    max_chars = max_tokens * chars_per_token
+
+    # Quick return if content fits in one chunk
+    if len(normalized_content) <= max_chars:
+        return [normalized_content]
+
+    chunks = []
+    start = 0
+
+    while start < len(normalized_content):
+        # Determine end position of this chunk
+        end = min(start + max_chars, len(normalized_content))
+
+        # If we're not at the end of the content, find last space
+        if end < len(normalized_content):
+            # Look for the last space within the chunk
+            last_space = normalized_content.rfind(' ', start, end)
+
+            if last_space != -1:  # If we found a space
+                end = last_space  # Cut at the space
+            # If no space found (very rare for large chunks), we'd cut at max_chars
+
+        # Add the chunk and move to next position
+        chunks.append(normalized_content[start:end])
+        start = end + 1  # Skip the space
+
+    return chunks
+
+def split_content_into_spans(content, max_tokens=CHUNK_MAX_TOKENS, chars_per_token=CHARS_PER_TOKEN,
+                             overlap_tokens=CHUNK_OVERLAP_TOKENS, snap_to_sentence=True) -> List[Tuple[int, int]]:
+    """
+    Split content into (start, end) character spans of the original text in a single pass.
+    Cuts prefer a sentence end in the last fifth of the chunk, then the last whitespace.
+    Consecutive spans overlap by roughly `overlap_tokens` worth of characters.
+    """
+    max_chars = max_tokens * chars_per_token
+    overlap_chars = min(overlap_tokens * chars_per_token, max_chars // 2)
+    snap_window = max_chars // 5
+    length = len(content)
+
+    spans = []
+    start = 0
+    while start < length:
+        # Skip whitespace so spans start on text
+        while start < length and content[start].isspace():
+            start += 1
+        if start >= length:
+            break
+
+        end = min(start + max_chars, length)
+        if end < length:
+            cut = -1
+            if snap_to_sentence:
+                window_start = max(start + 1, end - snap_window)
+                for separator in SENTENCE_BREAKS:
+                    position = content.rfind(separator, window_start, end)
+                    if position != -1:
+                        cut = max(cut, position + 1)  # Keep the punctuation in this chunk
+            if cut == -1:
+                # Fall back to the last whitespace within the chunk
+                for position in range(end, start, -1):
+                    if content[position].isspace():
+                        cut = position
+                        break
+            if cut > start:
+                end = cut
+
+        # Trim trailing whitespace from the span
+        span_end = end
+        while span_end > start and content[span_end - 1].isspace():
+            span_end -= 1
+        spans.append((start, span_end))
+
+        if end >= length:
+            break
+
+        next_start = end
+        if overlap_chars:
+            # Step back for overlap, then forward to a word boundary so words are not split
+            next_start = max(start + 1, end - overlap_chars)
+            while next_start < end and not content[next_start - 1].isspace():
+                next_start += 1
+        start = next_start
+
+    return spans
+
+def page_for_offset(page_offsets: List[int], offset: int) -> int:
+    """Return the 0-indexed page containing a character offset, given each page's start offset."""
+    return max(0, bisect_right(page_offsets, offset) - 1)
+
+def make_chunk_id(arxiv_id: str, chunk_type: str, section_id: str, subsection_id: str, chunk_index: int, content: str) -> str:
+    """
+    Build a stable chunk ID from the chunk's position and content.
+    Re-indexing identical text yields the same ID, so unchanged chunks are never re-embedded.
+    """
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    key = "\x1f".join([arxiv_id, chunk_type, section_id or "", subsection_id or "", str(chunk_index), content_hash])
+    return f"{chunk_type}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}"
+
+def build_paper_chunks(arxiv_id: str, content: Optional[str], sections: Optional[List[dict]] = None,
+                       page_offsets: Optional[List[int]] = None) -> List[dict]:
+    """
+    Split paper content and sections into chunks with IDs, embedding titles and metadata.
+    `page_offsets` holds the start offset of each page in `content`; without it pages are estimated.
+    """
+    chunks = []
+
+    # Main content chunks, mapped to pages through their offsets into the extracted text
+    if content:
+        spans = split_content_into_spans(content)
+        chars_per_page = len(content) / max(20, 1)  # Fallback: assume at least 20 pages
+
+        for i, (start, end) in enumerate(spans):
+            chunk = ' '.join(content[start:end].split())
+            if page_offsets:
+                start_page = page_for_offset(page_offsets, start) + 1
+                end_page = page_for_offset(page_offsets, max(start, end - 1)) + 1
+            else:
+                # Estimate page number based on character position
+                start_page = max(1, int(start / chars_per_page) + 1)
+                end_page = max(start_page, int(max(start, end - 1) / chars_per_page) + 1)
+
+            chunks.append({
+                'id': make_chunk_id(arxiv_id, 'content', '', '', i, chunk),
+                'document': chunk,
+                'title': f"Paper {arxiv_id}",
+                'metadata': {
+                    'type': 'content',
+                    'chunk_index': str(i),
+                    'total_chunks': str(len(spans)),
+                    'estimated_page': str(start_page),
+                    'end_page': str(end_page),
+                    'page_exact': str(bool(page_offsets)),
+                    'chunk_start_pos': str(start),
+                    'chunk_end_pos': str(end),
+                    'arxiv_id': arxiv_id
+                }
+            })
+
+    for section in sections or []:
+        try:
+            section_content = section.get('content', '')
+            if not section_content:
+                continue
+
+            section_chunks = split_content_by_tokens(section_content)
+            for i, chunk in enumerate(section_chunks):
+                chunks.append({
+                    'id': make_chunk_id(arxiv_id, 'section', section.get('id', ''), '', i, chunk),
+                    'document': chunk,
+                    'title': f"Paper {arxiv_id} - {section.get('title', 'Section')}",
+                    'metadata': {
+                        'type': 'section',
+                        'section_id': section.get('id', ''),
+                        'section_title': section.get('title', ''),
+                        'chunk_index': str(i),
+                        'total_chunks': str(len(section_chunks)),
+                        'page_number': str(section.get('page_number', '')),
+                        'arxiv_id': arxiv_id
+                    }
+                })
+
+            for subsection in section.get('subsections', []):
+                subsection_content = subsection.get('content', '')
+                if not subsection_content:
+                    continue
+
+                subsection_chunks = split_content_by_tokens(subsection_content)
+                for i, chunk in enumerate(subsection_chunks):
+                    chunks.append({
+                        'id': make_chunk_id(arxiv_id, 'subsection', section.get('id', ''), subsection.get('id', ''), i, chunk),
+                        'document': chunk,
+                        'title': f"Paper {arxiv_id} - {subsection.get('title', 'Subsection')}",
+                        'metadata': {
+                            'type': 'subsection',
+                            'section_id': section.get('id', ''),
+                            'section_title': section.get('title', ''),
+                            'subsection_id': subsection.get('id', ''),
+                            'subsection_title': subsection.get('title', ''),
+                            'chunk_index': str(i),
+                            'total_chunks': str(len(subsection_chunks)),
+                            'page_number': str(subsection.get('page_number', '')),
+                            'arxiv_id': arxiv_id
+                        }
+                    })
+        except Exception as e:
+            print(f"Error processing section: {str(e)}")
+
+    return chunks
+
+def sync_paper_collection(collection, chunks: List[dict], embedding_service, chunk_types, delete_stale: bool = True) -> dict:
+    """
+    Bring a paper's ChromaDB collection in line with `chunks`.
+    Only chunks whose ID is not already stored are embedded. Stored chunks of the given
+    `chunk_types` that are no longer produced are deleted; other chunk types are left alone.
+    With delete_stale=False the chunks are only added, and nothing else in the collection is read or removed.
+    """
+    chunk_types = set(chunk_types)
+
+    # Duplicate text at the same position produces the same ID; keep the first occurrence
+    chunks_by_id = {}
+    for chunk in chunks:
+        chunks_by_id.setdefault(chunk['id'], chunk)
+
+    existing_ids = set()
+    stale_ids = []
+    if not delete_stale:
+        # Only look up the chunks being written
+        if chunks_by_id:
+            existing_ids.update(collection.get(ids=list(chunks_by_id), include=[])['ids'])
+    else:
+        existing = collection.get(include=['metadatas'])
+        for chunk_id, metadata in zip(existing['ids'], existing['metadatas']):
+            if (metadata or {}).get('type', 'content') not in chunk_types:
+                continue
+            existing_ids.add(chunk_id)
+            if chunk_id not in chunks_by_id:
+                stale_ids.append(chunk_id)
+
+    new_chunks = [chunk for chunk_id, chunk in chunks_by_id.items() if chunk_id not in existing_ids]
+    kept_chunks = [chunk for chunk_id, chunk in chunks_by_id.items() if chunk_id in existing_ids]
+
+    print(f"Index diff: {len(new_chunks)} new, {len(kept_chunks)} unchanged, {len(stale_ids)} stale chunks")
+
+    # Generate embeddings only for new or changed chunks
+    embedded_chunks = []
+    if new_chunks:
+        embeddings = embedding_service.get_embeddings_batch(
+            [(chunk['document'], chunk['title']) for chunk in new_chunks]
+        )
+        for chunk, embedding in zip(new_chunks, embeddings):
+            if embedding is None:
+                print(f"Skipping {chunk['metadata']['type']} chunk {chunk['metadata']['chunk_index']} ({chunk['title']}): embedding failed")
+                continue
+            embedded_chunks.append((chunk, embedding))
+
+    if embedded_chunks:
+        collection.upsert(
+            ids=[chunk['id'] for chunk, _ in embedded_chunks],
+            documents=[chunk['document'] for chunk, _ in embedded_chunks],
+            embeddings=[embedding for _, embedding in embedded_chunks],
+            metadatas=[chunk['metadata'] for chunk, _ in embedded_chunks]
+        )
+
+    # Unchanged chunks keep their embeddings; refresh metadata such as total_chunks
+    if kept_chunks:
+        collection.update(
+            ids=[chunk['id'] for chunk in kept_chunks],
+            metadatas=[chunk['metadata'] for chunk in kept_chunks]
+        )
+
+    if stale_ids:
+        collection.delete(ids=stale_ids)
+
+    return {
+        "added": len(embedded_chunks),
+        "unchanged": len(kept_chunks),
+        "deleted": len(stale_ids),
+        "failed": len(new_chunks) - len(embedded_chunks)
+    }
+
+def index_paper(collection, embedding_service, arxiv_id: str, content: Optional[str], sections: Optional[List[dict]] = None,
+                page_offsets: Optional[List[int]] = None, delete_stale: bool = True) -> dict:
+    """
+    Incrementally index paper content and/or sections.
+    Passing content=None leaves stored content chunks untouched; likewise for sections=None.
+    delete_stale=False only adds chunks, e.g. one section as it finishes, leaving cleanup to a later full sync.
+    """
+    chunk_types = []
+    if content is not None:
+        chunk_types.append('content')
+    if sections is not None:
+        chunk_types.extend(['section', 'subsection'])
+
+    chunks = build_paper_chunks(arxiv_id, content, sections, page_offsets)
+    return sync_paper_collection(collection, chunks, embedding_service, chunk_types, delete_stale)
@@ -0,0 +1,1411 @@
+"""
+The paper processing pipeline: PDF extraction, metadata and section generation, search
+indexing and the generated Next.js page. The job workers (worker.py) run it and the API
+(main.py) shares its services and helpers, so neither has to import the other.
+"""
+
+import os
+import re
+import json
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import List
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+# Load environment variables
+load_dotenv('.env.local')
+
+from database import Paper, PaperImage
+from pdf_processor import PDFProcessor, load_stored_pdf
+from llm_service import LLMService
+from embedding_service import EmbeddingService
+from blob_store import get_blob_store
+from paper_indexer import index_paper, make_chroma_client
+
+# Services shared by the pipeline and the API routes
+pdf_processor = PDFProcessor()
+llm_service = LLMService()
+
+# Google GenAI embedding service and ChromaDB
+embedding_service = EmbeddingService()
+chroma_client = make_chroma_client()
+
+# Path to frontend directory - use absolute path (replace with actual path)
+# Get current directory and navigate to frontend
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+FRONTEND_PATH = os.path.join(parent_dir, "deeprxiv-frontend")
+print(f"Frontend path is set to: {FRONTEND_PATH}")
+
+# Track progress for each paper
+paper_processing_status = {}
+
+# Section and subsection content LLM calls in flight per paper
+SECTION_GENERATION_CONCURRENCY = int(os.getenv("SECTION_GENERATION_CONCURRENCY", "4"))
+
+class ProcessingCancelled(Exception):
+    """Raised between pipeline stages once the caller's cancel event is set (e.g. a worker lost its job lease)."""
+
+def check_cancelled(cancel, arxiv_id: str):
+    if cancel is not None and cancel.is_set():
+        raise ProcessingCancelled(f"Processing of {arxiv_id} was cancelled")
+
+def index_paper_content(arxiv_id: str, content: str, sections: List[dict] = None, page_offsets: List[int] = None,
+                        delete_stale: bool = True):
+    """Index paper content and sections in ChromaDB, embedding only new or changed chunks."""
+    try:
+        collection = chroma_client.get_or_create_collection(
+            name=f"paper_{arxiv_id}",
+            metadata={"hnsw:space": "cosine"}
+        )
+        
+        index_stats = index_paper(collection, embedding_service, arxiv_id, content, sections, page_offsets, delete_stale)
+        print(f"Successfully indexed paper {arxiv_id}: {index_stats['added']} added, "
+              f"{index_stats['unchanged']} unchanged, {index_stats['deleted']} removed, {index_stats['failed']} failed")
+        return index_stats
+        
+    except Exception as e:
+        print(f"Error indexing paper {arxiv_id}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+
+def load_page_offsets(paper):
+    """Parse a paper's page offset table, or None if it was processed before offsets were stored."""
+    try:
+        return json.loads(paper.page_offsets) if paper.page_offsets else None
+    except (TypeError, json.JSONDecodeError):
+        return None
+
+PDF_CHUNK_SIZE = 1024 * 1024
+
+def store_paper_pdf(paper, chunks):
+    """Stream a PDF into the blob store; the paper row only keeps its key, size and hash."""
+    key, size = get_blob_store().put_stream(chunks, "pdf")
+    paper.pdf_blob_key = key
+    paper.pdf_size = size
+    paper.pdf_sha256 = key.split(".", 1)[0]
+    paper.pdf_data = None
+
+def load_paper_pdf(paper):
+    """A paper's PDF from the blob store, or its legacy pdf_data column (see load_stored_pdf)."""
+    return load_stored_pdf(
+        paper.pdf_blob_key, paper.pdf_size, paper.pdf_sha256,
+        fallback=lambda: paper.pdf_data, label=paper.arxiv_id
+    )
+
+
+def save_paper_images(db: Session, paper: Paper, images: List[dict]):
+    """Replace the paper's rows in the image index used by /api/image/{image_id}."""
+    db.query(PaperImage).filter(PaperImage.paper_id == paper.id).delete(synchronize_session=False)
+    for image in images:
+        db.add(PaperImage(
+            image_id=image["id"],
+            paper_id=paper.id,
+            page=image.get("page", 0),
+            bbox=json.dumps(image["bbox"]) if image.get("bbox") else None,
+            blob_key=image.get("blob_key"),
+            path=image.get("path"),
+            image_format=image.get("format")
+        ))
+
+def generate_section_contents(arxiv_id: str, paper_text: str, sections: List[dict], on_item_complete=None,
+                              status=None, cancel=None):
+    """
+    Generate detailed content for all sections and subsections with up to SECTION_GENERATION_CONCURRENCY
+    LLM calls in flight. Each result is written back to the item it was generated for, so the
+    sections keep their order however the calls finish. Items whose generation fails keep their outline content.
+    Every item gets a "status" of pending, complete or failed. `on_item_complete(i, j, section_complete)` is
+    called from this thread after each item, with j None for the section itself and `section_complete`
+    True once section i and all its subsections are done. Outline items are LLM output, so a missing title
+    or content only affects that item; one with neither is marked failed without a call. Progress messages go to `status`
+    (paper_processing_status by default). Setting `cancel` drops the queued calls and raises ProcessingCancelled.
+    """
+    status = paper_processing_status if status is None else status
+    items = []
+    remaining = []
+    for i, section in enumerate(sections):
+        items.append((i, None, section))
+        for j, subsection in enumerate(section.get("subsections") or []):
+            items.append((i, j, subsection))
+        remaining.append(1 + len(section.get("subsections") or []))
+    for _, _, item in items:
+        item["status"] = "pending"
+    
+    print(f"Generating content for {len(items)} sections and subsections, {SECTION_GENERATION_CONCURRENCY} at a time")
+    status[arxiv_id] = f"Generating content for sections (0/{len(items)})"
+    
+    completed = 0
+    with ThreadPoolExecutor(max_workers=SECTION_GENERATION_CONCURRENCY) as executor:
+        futures = {}
+        for i, j, item in items:
+            if not item.get("title") and not item.get("content"):
+                future = Future()
+                future.set_result({"error": "outline item has no title or content"})
+            else:
+                future = executor.submit(
+                    llm_service.generate_section_content, paper_text, item.get("title", ""), item.get("content", "")
+                )
+            futures[future] = (i, j, item)
+        for future in as_completed(futures):
+            i, j, item = futures[future]
+            kind = "section" if j is None else f"subsection of {sections[i].get('title', '')}"
+            try:
+                response = future.result()
+            except Exception as e:
+                response = {"error": str(e)}
+            
+            if cancel is not None and cancel.is_set():
+                # Nothing more is saved or indexed; calls already in flight finish but are discarded
+                for pending in futures:
+                    pending.cancel()
+                check_cancelled(cancel, arxiv_id)
+            
+            if response.get("error"):
+                item["status"] = "failed"
+                print(f"Error generating content for {kind} {item.get('title', '')}: {response['error']}")
+            else:
+                item["status"] = "complete"
+                item["content"] = response["content"]
+                # Add citations to the item if available
+                if response.get("citations"):
+                    item["citations"] = response["citations"]
+                print(f"Generated content for {kind} {item.get('title', '')} ({len(item['content'])} chars)")
+            
+            completed += 1
+            remaining[i] -= 1
+            status[arxiv_id] = f"Generating content for sections ({completed}/{len(items)}): {item.get('title', '')}"
+            print(f"Status: {status[arxiv_id]}")
+            
+            if on_item_complete:
+                try:
+                    on_item_complete(i, j, remaining[i] == 0)
+                except Exception as callback_error:
+                    print(f"Error handling completed {kind} {item.get('title', '')}: {str(callback_error)}")
+
+def process_paper(arxiv_id: str, db: Session = None, status=None, cancel=None):
+    """
+    Process a paper and update the database. Progress messages are written to `status`, a dict
+    keyed by arXiv ID: paper_processing_status by default, or the worker's JobProgress.
+    `cancel` is an optional threading.Event checked between stages; once it is set the run stops
+    before writing anything else and returns None.
+    """
+    status = paper_processing_status if status is None else status
+    # Import database modules locally to ensure they're available in this context
+    from database import SessionLocal
+    
+    # Create a new session if one wasn't provided
+    own_session = False
+    if db is None:
+        db = SessionLocal()
+        own_session = True
+        
+    paper = db.query(Paper).filter(Paper.arxiv_id == arxiv_id).first()
+    if not paper:
+        if own_session:
+            db.close()
+        return
+    
+    try:
+        print(f"================ PROCESSING PAPER {arxiv_id} ================")
+        # Update status
+        status[arxiv_id] = "Extracting content from PDF"
+        print(f"Status: {status[arxiv_id]}")
+        
+        # Extract content from PDF; highlights must not reuse renders of a previous PDF
+        pdf_processor.invalidate_paper_caches(arxiv_id)
+        pdf_content = pdf_processor.process_pdf(load_paper_pdf(paper), arxiv_id=arxiv_id)
+        check_cancelled(cancel, arxiv_id)
+        
+        # Store extracted text and where each page starts in it
+        paper.extracted_text = pdf_content["text"]
+        paper.page_offsets = json.dumps(pdf_content["page_offsets"])
+        print(f"Extracted text length: {len(paper.extracted_text)} across {len(pdf_content['page_offsets'])} pages")
+        
+        # Store extracted images as JSON
+        # Ensure we're storing JSON as strings for SQLite compatibility
+        extracted_images = [img for img in pdf_content["images"]]
+        paper.extracted_images = json.dumps(extracted_images)
+        save_paper_images(db, paper, extracted_images)
+        print(f"Extracted {len(extracted_images)} images")
+        
+        # Save initial extraction data to database
+        db.add(paper)
+        db.commit()
+        db.refresh(paper)
+        print("Saved extracted text and images to database")
+        
+        # Index the raw text right away so chat works while metadata and sections are generated
+        check_cancelled(cancel, arxiv_id)
+        status[arxiv_id] = "Indexing extracted text for search"
+        print(f"Status: {status[arxiv_id]}")
+        if index_paper_content(arxiv_id, paper.extracted_text, None, load_page_offsets(paper)) is not None:
+            paper.content_indexed = True
+            db.commit()
+            print(f"Paper {arxiv_id} is searchable from its extracted text")
+        
+        # Update status
+        check_cancelled(cancel, arxiv_id)
+        status[arxiv_id] = "Extracting metadata"
+        print(f"Status: {status[arxiv_id]}")
+        
+        # Text from the first 4 pages for metadata extraction, taken from the same parse
+        first_pages_text = pdf_content["first_pages_text"]
+        
+        # Generate metadata using Flash LLM on first pages
+        print("Generating metadata using LLM...")
+        metadata_json = llm_service.extract_paper_metadata_flash(first_pages_text)
+        try:
+            # Clean JSON response if it starts with ```json and ends with ```
+            if metadata_json.startswith("```json"):
+                metadata_json = metadata_json.replace("```json", "", 1)
+                if metadata_json.endswith("```"):
+                    metadata_json = metadata_json[:-3]
+                metadata_json = metadata_json.strip()
+            
+            print(f"Raw metadata JSON: {metadata_json}")
+            
+            # Parse JSON
+            metadata = json.loads(metadata_json)
+            
+            # Update paper with extracted metadata
+            if "Title" in metadata:
+                paper.title = metadata.get("Title", "")
+            elif "title" in metadata:
+                paper.title = metadata.get("title", "")
+                
+            authors_field = None
+            if "Authors" in metadata:
+                authors_field = "Authors"
+            elif "authors" in metadata:
+                authors_field = "authors"
+                
+            if authors_field and isinstance(metadata.get(authors_field), list):
+                paper.authors = ", ".join(metadata.get(authors_field, []))
+            elif authors_field:
+                paper.authors = metadata.get(authors_field, "")
+                
+            if "Abstract" in metadata:
+                paper.abstract = metadata.get("Abstract", "")
+            elif "abstract" in metadata:
+                paper.abstract = metadata.get("abstract", "")
+                
+            print(f"Successfully processed metadata: Title='{paper.title}', Authors='{paper.authors}'")
+            print(f"Abstract length: {len(paper.abstract) if paper.abstract else 0}")
+            
+            # Save metadata to database
+            db.add(paper)
+            db.commit()
+            db.refresh(paper)
+            print("Saved metadata to database")
+            
+        except json.JSONDecodeError as e:
+            print(f"Error parsing metadata JSON: {metadata_json}")
+            print(f"JSON error: {str(e)}")
+            # Try to extract metadata from the raw text as a fallback
+            try:
+                print("Attempting fallback metadata extraction from text...")
+                if "Title:" in first_pages_text or "TITLE:" in first_pages_text:
+                    # Simple pattern matching as fallback
+                    title_pattern = r"(?:Title|TITLE):(.*?)(?:\n|Authors|ABSTRACT)"
+                    title_match = re.search(title_pattern, first_pages_text, re.DOTALL | re.IGNORECASE)
+                    if title_match:
+                        paper.title = title_match.group(1).strip()
+                        print(f"Extracted title by regex: {paper.title}")
+                    
+                    authors_pattern = r"(?:Authors|AUTHOR[S]?):(.*?)(?:\n|Abstract|ABSTRACT)"
+                    authors_match = re.search(authors_pattern, first_pages_text, re.DOTALL | re.IGNORECASE)
+                    if authors_match:
+                        paper.authors = authors_match.group(1).strip()
+                        print(f"Extracted authors by regex: {paper.authors}")
+                    
+                    abstract_pattern = r"(?:Abstract|ABSTRACT):(.*?)(?:\n\n|\n#|Introduction|INTRODUCTION)"
+                    abstract_match = re.search(abstract_pattern, first_pages_text, re.DOTALL | re.IGNORECASE)
+                    if abstract_match:
+                        paper.abstract = abstract_match.group(1).strip()
+                        print(f"Extracted abstract by regex: {paper.abstract[:100]}...")
+                        
+                # Save fallback metadata to database
+                db.add(paper)
+                db.commit()
+                db.refresh(paper)
+                print("Saved fallback metadata to database")
+            except Exception as fallback_error:
+                print(f"Error in fallback metadata extraction: {str(fallback_error)}")
+        
+        # Update status
+        check_cancelled(cancel, arxiv_id)
+        status[arxiv_id] = "Generating paper sections with LLM"
+        print(f"Status: {status[arxiv_id]}")
+        
+        # Generate sections data with Perplexity
+        try:
+            print(f"Starting LLM section generation for paper {arxiv_id}...")
+            print(f"Paper text length: {len(paper.extracted_text)} characters")
+            
+            sections_response = llm_service.generate_paper_sections(paper.extracted_text)
+            print(f"LLM section generation completed successfully")
+            print(f"Response type: {type(sections_response)}")
+            print(f"Response keys: {sections_response.keys() if isinstance(sections_response, dict) else 'Not a dict'}")
+            
+            sections = sections_response["sections"]
+            citations = sections_response["citations"]
+            
+            print(f"LLM generated {len(sections)} sections:")
+            for i, section in enumerate(sections):
+                print(f"  Section {i+1}: {section.get('title', '')}")
+                if 'subsections' in section and section['subsections']:
+                    for j, subsection in enumerate(section['subsections']):
+                        print(f"    Subsection {j+1}: {subsection.get('title', '')}")
+            
+            # Store the sections and citations data as JSON; readers see the outline now and
+            # each section's content as soon as it is generated
+            sections_data_to_save = {
+                "sections": sections,
+                "citations": citations,
+                "status": "generating"
+            }
+            
+            def save_sections():
+                paper.sections_data = json.dumps(sections_data_to_save)
+                db.add(paper)
+                db.commit()
+            
+            def on_item_complete(i, j, section_complete):
+                save_sections()
+                if section_complete:
+                    # Add just the finished section to the search index. Chunks of the previous run stay
+                    # searchable until the final sync below replaces them
+                    index_paper_content(arxiv_id, None, [sections[i]], delete_stale=False)
+            
+            for section in sections:
+                section["status"] = "pending"
+                for subsection in section.get("subsections") or []:
+                    subsection["status"] = "pending"
+            save_sections()
+            print("Saved section outline to database")
+            
+            # Generate detailed content for every section and subsection concurrently
+            generate_section_contents(arxiv_id, paper.extracted_text, sections, on_item_complete, status, cancel)
+            sections_data_to_save["status"] = "complete"
+            
+            # Debug: Log subsections info
+            total_subsections = 0
+            for section in sections:
+                if 'subsections' in section and section['subsections']:
+                    subsection_count = len(section['subsections'])
+                    total_subsections += subsection_count
+                    print(f"Section '{section.get('title', '')}' has {subsection_count} subsections:")
+                    for i, subsection in enumerate(section['subsections']):
+                        print(f"  {i+1}. {subsection.get('title', 'No title')} (ID: {subsection.get('id', 'No ID')})")
+                else:
+                    print(f"Section '{section.get('title', '')}' has no subsections")
+            
+            print(f"Total subsections across all sections: {total_subsections}")
+            
+            paper.sections_data = json.dumps(sections_data_to_save)
+            print(f"Successfully generated {len(sections)} sections with {total_subsections} total subsections for paper {arxiv_id}")
+            
+            # Save sections data to database
+            db.add(paper)
+            db.commit()
+            db.refresh(paper)
+            print("Saved sections data to database")
+            
+        except ProcessingCancelled:
+            raise
+        except Exception as sections_error:
+            print(f"CRITICAL ERROR in LLM section generation: {str(sections_error)}")
+            import traceback
+            traceback.print_exc()
+            
+            # Create a basic structure in case of error
+            basic_sections = [
+                {
+                    "id": "overview",
+                    "title": "Overview",
+                    "content": paper.abstract or "Paper overview not available.",
+                    "citations": [],
+                    "subsections": [
+                        {
+                            "id": "abstract-summary",
+                            "title": "Abstract Summary",
+                            "content": "This subsection provides a summary of the paper's abstract and main contributions.",
+                            "citations": [],
+                            "page_number": 1
+                        },
+                        {
+                            "id": "key-findings",
+                            "title": "Key Findings",
+                            "content": "This subsection highlights the main findings and results presented in the paper.",
+                            "citations": [],
+                            "page_number": 1
+                        }
+                    ],
+                    "page_number": 1
+                }
+            ]
+            paper.sections_data = json.dumps({
+                "sections": basic_sections,
+                "citations": []
+            })
+            print("Created and saved basic fallback sections due to LLM error")
+            # Save basic sections to database
+            db.add(paper)
+            db.commit()
+            db.refresh(paper)
+        
+        # Update status
+        check_cancelled(cancel, arxiv_id)
+        status[arxiv_id] = "Creating folder structure"
+        print(f"Status: {status[arxiv_id]}")
+        
+        # Set the paper as processed
+        paper.processed = True
+        
+        # Commit the changes to the database
+        db.add(paper)
+        db.commit()
+        db.refresh(paper)
+        print(f"Paper {arxiv_id} successfully processed and saved to database")
+        
+        # Reconcile the index with the final text and sections; chunks indexed along the way are not re-embedded
+        check_cancelled(cancel, arxiv_id)
+        status[arxiv_id] = "Indexing content for search"
+        print(f"Status: {status[arxiv_id]}")
+        
+        try:
+            # Parse sections data for indexing
+            sections_for_indexing = None
+            if paper.sections_data:
+                sections_data = json.loads(paper.sections_data)
+                if isinstance(sections_data, dict):
+                    sections_for_indexing = sections_data.get("sections", [])
+                elif isinstance(sections_data, list):
+                    sections_for_indexing = sections_data
+            
+            # Index the paper content and sections
+            index_paper_content(arxiv_id, paper.extracted_text, sections_for_indexing, load_page_offsets(paper))
+            print(f"Successfully indexed paper {arxiv_id} for RAG chatbot")
+        except Exception as indexing_error:
+            print(f"Error indexing paper {arxiv_id}: {str(indexing_error)}")
+            import traceback
+            traceback.print_exc()
+            # Don't fail the entire process if indexing fails
+        
+        # Verify data was saved
+        db.refresh(paper)
+        verification_data = {
+            "title": paper.title,
+            "authors": paper.authors,
+            "abstract_length": len(paper.abstract) if paper.abstract else 0,
+            "extracted_text_length": len(paper.extracted_text) if paper.extracted_text else 0,
+            "sections_data_length": len(paper.sections_data) if paper.sections_data else 0,
+            "processed": paper.processed
+        }
+        print(f"Verification - Paper data: {json.dumps(verification_data)}")
+        
+        # Create folder-based structure in Next.js frontend
+        create_nextjs_folder_structure(paper)
+        
+        # Clear status
+        if arxiv_id in status:
+            del status[arxiv_id]
+            
+        print(f"================ FINISHED PROCESSING PAPER {arxiv_id} ================")
+        return paper
+    except ProcessingCancelled as e:
+        # Whoever cancelled owns the outcome, so the status is left alone
+        print(f"🛑 {str(e)}")
+        db.rollback()
+    except Exception as e:
+        print(f"Error processing paper: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        status[arxiv_id] = f"Error: {str(e)}"
+        db.rollback()
+    finally:
+        # Close the session if we created it
+        if own_session:
+            db.close()
+
+def create_nextjs_folder_structure(paper):
+    """
+    Create a folder structure in the Next.js frontend for the paper.
+    This creates:
+    - /app/abs/{arxiv_id}/ folder
+    - README.md with paper metadata
+    - page.tsx file for the paper
+    """
+    try:
+        # Define the path to the frontend app and paper folder
+        if not os.path.exists(FRONTEND_PATH):
+            print(f"Frontend path not found: {FRONTEND_PATH}")
+            return
+        
+        paper_folder = os.path.join(FRONTEND_PATH, "app", "abs", paper.arxiv_id)
+        
+        # Create folder if it doesn't exist
+        os.makedirs(paper_folder, exist_ok=True)
+        
+        # Create README.md
+        readme_content = f"""# {paper.title or 'Untitled Paper'}
+
+## arXiv ID
+{paper.arxiv_id}
+
+## Authors
+{paper.authors or 'No authors listed'}
+
+## Abstract
+{paper.abstract or 'No abstract available'}
+
+## Links
+- [View on arXiv](https://arxiv.org/abs/{paper.arxiv_id})
+- [Download PDF](https://arxiv.org/pdf/{paper.arxiv_id}.pdf)
+
+## Extracted Text
+{paper.extracted_text[:1000] + '...' if paper.extracted_text and len(paper.extracted_text) > 1000 else paper.extracted_text or 'No extracted text available'}
+"""
+        with open(os.path.join(paper_folder, "README.md"), "w", encoding="utf-8") as f:
+            f.write(readme_content)
+        
+        # Get sections data if available, or create a basic structure
+        try:
+            sections_data = json.loads(paper.sections_data) if paper.sections_data else {}
+            
+            # Handle different formats of sections_data
+            if isinstance(sections_data, dict):
+                # New format with sections and citations
+                sections = sections_data.get("sections", [])
+                citations = sections_data.get("citations", [])
+            elif isinstance(sections_data, list):
+                # Old format - direct list of sections
+                sections = sections_data
+                citations = []
+            else:
+                # Fallback for unexpected format
+                sections = []
+                citations = []
+                
+            # Ensure we have valid sections
+            if not sections or not isinstance(sections, list):
+                sections = [
+                    {
+                        "id": "overview",
+                        "title": "Overview",
+                        "content": paper.abstract or "Paper overview not available.",
+                        "citations": [],
+                        "subsections": []
+                    }
+                ]
+                
+            # Ensure citations is a list
+            if not isinstance(citations, list):
+                citations = []
+                
+        except (json.JSONDecodeError, TypeError, AttributeError) as e:
+            print(f"Error parsing sections data: {e}")
+            sections = [
+                {
+                    "id": "overview",
+                    "title": "Overview",
+                    "content": paper.abstract or "Paper overview not available.",
+                    "citations": [],
+                    "subsections": []
+                }
+            ]
+            citations = []
+        
+        # Parse extracted images from the paper
+        try:
+            if isinstance(paper.extracted_images, str):
+                images = json.loads(paper.extracted_images)
+            else:
+                images = paper.extracted_images or []
+                
+            # Add API URLs for each image
+            for image in images:
+                if 'id' in image:
+                    image['url'] = f"/api/image/{image['id']}"
+        except (json.JSONDecodeError, TypeError, AttributeError):
+            images = []
+        
+        # Create a simplified page.tsx with enhanced markdown support
+        # We'll avoid complex templating with f-strings
+        safe_title = (paper.title or "Untitled Paper").replace("'", "\\'").replace('"', '\\"')
+        safe_authors = (paper.authors or "").replace("'", "\\'").replace('"', '\\"')
+        safe_abstract = (paper.abstract or "").replace("'", "\\'").replace('"', '\\"').replace("\n", " ")
+        
+        sections_json = json.dumps(sections).replace("'", "\\'").replace("`", "\\`")
+        citations_json = json.dumps(citations).replace("'", "\\'").replace("`", "\\`")
+        
+        page_content = """'use client';
+
+import { useState, useEffect, useRef } from 'react';
+import Link from 'next/link';
+import { ArrowLeft, Image as ImageIcon, ExternalLink, X, Play, FileText, BookOpen, Menu, MessageCircle } from 'lucide-react';
+import ReactMarkdown from 'react-markdown';
+import remarkGfm from 'remark-gfm';
+import remarkMath from 'remark-math';
+import rehypeKatex from 'rehype-katex';
+import 'katex/dist/katex.min.css';
+
+// Custom CSS for hiding scrollbars and responsive margins
+const customStyles = `
+  .scrollbar-hide {
+    -ms-overflow-style: none;  /* Internet Explorer 10+ */
+    scrollbar-width: none;  /* Firefox */
+  }
+  .scrollbar-hide::-webkit-scrollbar {
+    display: none;  /* Safari and Chrome */
+  }
+  .main-content {
+    margin-left: 0;
+    margin-right: 0;
+  }
+  @media (min-width: 768px) {
+    .main-content {
+      margin-left: 352px;
+      margin-right: 0;
+    }
+  }
+  @media (min-width: 1024px) {
+    .main-content {
+      margin-left: 416px;
+      margin-right: 512px;
+    }
+  }
+`;
+
+// Types for better TypeScript support
+interface ImageData {
+  id: string;
+  page: number;
+  original_position?: {
+    x: number;
+    y: number;
+    width: number;
+    height: number;
+  };
+  expanded_position?: {
+    x: number;
+    y: number;
+    width: number;
+    height: number;
+  };
+  path?: string;
+  url?: string;
+}
+
+interface SubSection {
+  id: string;
+  title: string;
+  content: string;
+  citations?: string[];
+  page_number?: number;
+}
+
+interface Section {
+  id: string;
+  title: string;
+  content: string;
+  citations?: string[];
+  page_number?: number;
+  subsections?: SubSection[];
+}
+
+// Paper data
+const paperData = {
+  id: """ + str(paper.id or 0) + """,
+  arxiv_id: '""" + paper.arxiv_id + """',
+  title: '""" + safe_title + """',
+  authors: '""" + safe_authors + """',
+  abstract: '""" + safe_abstract + """',
+  processed: true
+};
+
+// Sections data
+const sectionsData: Section[] = """ + sections_json + """;
+const citationsData: string[] = """ + citations_json + """;
+
+// YouTube URL detection function
+const isYouTubeUrl = (url: string): boolean => {
+  return /(?:youtube\\.com\\/watch\\?v=|youtu\\.be\\/|youtube\\.com\\/embed\\/)/.test(url);
+};
+
+// Extract YouTube video ID
+const getYouTubeVideoId = (url: string): string | null => {
+  const match = url.match(/(?:youtube\\.com\\/watch\\?v=|youtu\\.be\\/|youtube\\.com\\/embed\\/)([^&\\n?#]+)/);
+  return match ? match[1] : null;
+};
+
+// Function to remove duplicate headings from markdown content
+const removeDuplicateHeading = (content: string, title: string): string => {
+  if (!content || !title) return content;
+  
+  // Create variations of the title to match against
+  const titleVariations = [
+    title.trim(),
+    title.trim().toLowerCase(),
+    title.replace(/[^a-zA-Z0-9\\s]/g, '').trim(),
+    title.replace(/[^a-zA-Z0-9\\s]/g, '').trim().toLowerCase()
+  ];
+  
+  // Split content into lines
+  const lines = content.split('\\n');
+  const filteredLines = [];
+  
+  for (let i = 0; i < lines.length; i++) {
+    const line = lines[i].trim();
+    
+    // Check if this line is a heading (starts with #)
+    if (line.match(/^#{1,6}\\s/)) {
+      // Extract the heading text (remove # and whitespace)
+      const headingText = line.replace(/^#{1,6}\\s*/, '').trim();
+      const headingTextLower = headingText.toLowerCase();
+              const headingTextClean = headingText.replace(/[^a-zA-Z0-9\\s]/g, '').trim();
+              const headingTextCleanLower = headingTextClean.toLowerCase();
+        
+        // Check if this heading matches any title variation
+        const isDuplicate = titleVariations.some(variation => 
+          headingText === variation ||
+          headingTextLower === variation ||
+          headingTextClean === variation ||
+          headingTextCleanLower === variation ||
+          variation.includes(headingText) ||
+          variation.includes(headingTextLower) ||
+          headingText.includes(variation) ||
+          headingTextLower.includes(variation)
+        );
+      
+      // Skip the first heading if it's a duplicate, but keep subsequent headings
+      if (isDuplicate && i < 3) {
+        continue;
+      }
+    }
+    
+    filteredLines.push(lines[i]);
+  }
+  
+  return filteredLines.join('\\n');
+};
+
+// Markdown component with math support
+const MarkdownContent = ({ content, title }: { content: string; title?: string }) => {
+  // Remove duplicate heading if title is provided
+  const processedContent = title ? removeDuplicateHeading(content, title) : content;
+  
+  return (
+    <ReactMarkdown
+      remarkPlugins={[remarkGfm, remarkMath]}
+      rehypePlugins={[rehypeKatex]}
+      className="prose prose-lg max-w-none text-gray-900 leading-relaxed"
+      components={{
+        // Custom styling for different elements
+        h1: ({ children }) => <h1 className="text-3xl font-bold text-gray-900 mb-4">{children}</h1>,
+        h2: ({ children }) => <h2 className="text-2xl font-semibold text-gray-900 mb-3">{children}</h2>,
+        h3: ({ children }) => <h3 className="text-xl font-medium text-gray-900 mb-2">{children}</h3>,
+        p: ({ children }) => <p className="text-black-900 mb-4 leading-relaxed">{children}</p>,
+        ul: ({ children }) => <ul className="list-disc list-inside mb-4 text-gray-900">{children}</ul>,
+        ol: ({ children }) => <ol className="list-decimal list-inside mb-4 text-gray-900">{children}</ol>,
+        li: ({ children }) => <li className="mb-1">{children}</li>,
+        blockquote: ({ children }) => <blockquote className="border-l-4 border-blue-500 pl-4 italic text-gray-600 mb-4">{children}</blockquote>,
+        code: ({ children, className }) => {
+          const isInline = !className;
+          if (isInline) {
+            return <code className="bg-gray-100 px-1 py-0.5 rounded text-sm font-mono text-gray-900">{children}</code>;
+          }
+          return <pre className="bg-black-100 p-4 rounded-lg overflow-x-auto mb-4"><code className="text-sm font-mono">{children}</code></pre>;
+        },
+        a: ({ children, href }) => <a href={href} className="text-blue-600 hover:text-blue-800 underline" target="_blank" rel="noopener noreferrer">{children}</a>,
+      }}
+    >
+      {processedContent}
+    </ReactMarkdown>
+  );
+};
+
+export default function PaperPage() {
+  const [activeContent, setActiveContent] = useState('');
+  const [imagesData, setImagesData] = useState<ImageData[]>([]);
+  const [imagesLoading, setImagesLoading] = useState(true);
+  const [selectedImage, setSelectedImage] = useState<ImageData | null>(null);
+  const [selectedPdfPage, setSelectedPdfPage] = useState<number | null>(null);
+  const [youtubeModal, setYoutubeModal] = useState<{ isOpen: boolean; videoId: string | null }>({
+    isOpen: false,
+    videoId: null
+  });
+  const [mobileMenuOpen, setMobileMenuOpen] = useState(false);
+  
+  // Fetch images from API
+  useEffect(() => {
+    const fetchImages = async () => {
+      try {
+        setImagesLoading(true);
+        const response = await fetch(`http://localhost:8000/api/images/${paperData.arxiv_id}`);
+        if (response.ok) {
+          const images = await response.json();
+          setImagesData(images);
+        } else {
+          console.error('Failed to fetch images:', response.statusText);
+          setImagesData([]);
+        }
+      } catch (error) {
+        console.error('Error fetching images:', error);
+        setImagesData([]);
+      } finally {
+        setImagesLoading(false);
+      }
+    };
+
+    fetchImages();
+  }, []);
+  
+  // Initialize with the first section
+  useEffect(() => {
+    if (sectionsData?.length > 0) {
+      setActiveContent(sectionsData[0].id);
+    }
+  }, []);
+  
+  // Get current content (section or subsection)
+  const getCurrentContent = () => {
+    // First check if it's a main section
+    const section = sectionsData?.find(section => section.id === activeContent);
+    if (section) {
+      return { type: 'section', content: section };
+    }
+    
+    // Then check if it's a subsection
+    for (const section of sectionsData || []) {
+      const subsection = section.subsections?.find(sub => sub.id === activeContent);
+      if (subsection) {
+        return { type: 'subsection', content: subsection, parentSection: section };
+      }
+    }
+    
+    return null;
+  };
+  
+  const currentContent = getCurrentContent();
+  
+  // Get relevant images for current content
+  const getRelevantImages = (pageNumber: number | undefined): ImageData[] => {
+    if (!pageNumber || !imagesData || !Array.isArray(imagesData)) return [];
+    return imagesData.filter(img => img.page === pageNumber);
+  };
+  
+  const relevantImages = getRelevantImages(currentContent?.content?.page_number);
+  
+  // Get citations for current content
+  const getSectionCitations = (citations?: string[]): string[] => {
+    if (!citations || !Array.isArray(citations)) return [];
+    return citations;
+  };
+  
+  const contentCitations = getSectionCitations(currentContent?.content?.citations);
+
+  // Handle citation click
+  const handleCitationClick = (citation: string) => {
+    if (isYouTubeUrl(citation)) {
+      const videoId = getYouTubeVideoId(citation);
+      if (videoId) {
+        setYoutubeModal({ isOpen: true, videoId });
+        return;
+      }
+    }
+    // For non-YouTube links, open in new tab
+    window.open(citation, '_blank', 'noopener,noreferrer');
+  };
+
+  // Handle PDF page view - open in new tab
+  const handlePdfPageView = (pageNumber: number) => {
+    const pdfUrl = `https://arxiv.org/pdf/${paperData.arxiv_id}.pdf#page=${pageNumber}`;
+    window.open(pdfUrl, '_blank', 'noopener,noreferrer');
+  };
+
+  // Handle chat redirect
+  const handleChatRedirect = () => {
+    window.location.href = `/chat?arxiv_id=${paperData.arxiv_id}`;
+  };
+
+  return (
+    <div className="min-h-screen flex flex-col bg-white">
+      <style jsx global>{customStyles}</style>
+      {/* Header */}
+      <header className="bg-white sticky top-0 z-50">
+        <div className="max-w-full mx-auto px-4">
+          <div className="flex items-center justify-between h-16 lg:pl-32 md:pl-16 pl-4">
+            <div className="flex items-center space-x-3">
+              <Link href="/" className="flex items-center text-blue-600 hover:text-blue-700">
+                <ArrowLeft className="w-6 h-6" />
+              </Link>
+              <h1 className="text-2xl font-bold text-gray-900 lowercase">deeprxiv</h1>
+              <span className="text-lg text-gray-800 font-medium truncate max-w-md lg:max-w-2xl">
+                {paperData.title}
+              </span>
+            </div>
+            <button 
+              onClick={() => setMobileMenuOpen(!mobileMenuOpen)}
+              className="md:hidden p-2 text-gray-600 hover:text-gray-900"
+            >
+              <Menu className="w-6 h-6" />
+            </button>
+          </div>
+        </div>
+      </header>
+
+      {/* Mobile Navigation Overlay */}
+      {mobileMenuOpen && (
+        <div className="fixed inset-0 bg-black bg-opacity-50 z-40 md:hidden" onClick={() => setMobileMenuOpen(false)}>
+          <div className="fixed left-0 top-16 bottom-0 w-80 bg-white overflow-y-auto" onClick={(e) => e.stopPropagation()}>
+            <div className="p-6">
+              <nav className="space-y-1">
+                {sectionsData?.map((section) => (
+                  <div key={section.id} className="space-y-1">
+                    <button
+                      onClick={() => {
+                        setActiveContent(section.id);
+                        setMobileMenuOpen(false);
+                      }}
+                      className={`block w-full text-left px-1 py-3 rounded-md transition-colors text-sm font-medium ${
+                        activeContent === section.id
+                          ? 'bg-blue-50 text-blue-700'
+                          : 'text-gray-900 hover:bg-gray-100'
+                      }`}
+                    >
+                      <div className="truncate" title={section.title}>
+                        {section.title}
+                      </div>
+                    </button>
+                    
+                    {section.subsections && section.subsections.length > 0 && (
+                      <div className="ml-8 space-y-1">
+                        {section.subsections.map((subsection) => (
+                          <button
+                            key={subsection.id}
+                            onClick={() => {
+                              setActiveContent(subsection.id);
+                              setMobileMenuOpen(false);
+                            }}
+                            className={`block w-full text-left px-3 py-2 rounded-md text-sm transition-colors ${
+                              activeContent === subsection.id
+                                ? 'bg-blue-25 text-blue-600'
+                                : 'text-gray-800 hover:bg-gray-50'
+                            }`}
+                          >
+                            <div className="truncate" title={subsection.title}>
+                              {subsection.title}
+                            </div>
+                          </button>
+                        ))}
+                      </div>
+                    )}
+                  </div>
+                ))}
+              </nav>
+            </div>
+          </div>
+        </div>
+      )}
+
+      {/* Main Content */}
+      <main className="flex-grow">
+        <div className="max-w-full mx-auto px-4">
+          <div className="flex min-h-screen">
+            {/* Left Sidebar - Navigation */}
+            <aside className="w-72 bg-white flex-shrink-0 fixed top-16 bottom-0 overflow-y-auto scrollbar-hide hidden md:block md:left-16 lg:left-32">
+              <div className="p-6">
+                <nav className="space-y-1">
+              {sectionsData?.map((section) => (
+                  <div key={section.id} className="space-y-1">
+                    {/* Main Section */}
+                <button
+                      onClick={() => setActiveContent(section.id)}
+                      className={`block w-full text-left px-1 py-3 rounded-md transition-colors text-sm font-medium ${
+                        activeContent === section.id
+                          ? 'bg-blue-50 text-blue-700'
+                      : 'text-gray-900 hover:bg-gray-100'
+                  }`}
+                >
+                      <div className="truncate" title={section.title}>
+                  {section.title}
+                      </div>
+                    </button>
+                    
+                    {/* All Subsections */}
+                    {section.subsections && section.subsections.length > 0 && (
+                      <div className="ml-8 space-y-1">
+                        {section.subsections.map((subsection) => (
+                          <button
+                            key={subsection.id}
+                            onClick={() => setActiveContent(subsection.id)}
+                            className={`block w-full text-left px-3 py-2 rounded-md text-sm transition-colors ${
+                              activeContent === subsection.id
+                                ? 'bg-blue-25 text-blue-600'
+                                : 'text-gray-800 hover:bg-gray-50'
+                            }`}
+                          >
+                            <div className="truncate" title={subsection.title}>
+                              {subsection.title}
+                            </div>
+                </button>
+                        ))}
+                      </div>
+                    )}
+                  </div>
+                              ))}
+                </nav>
+              </div>
+            </aside>
+
+            {/* Center Content Area */}
+            <div className="flex-1 bg-white px-6 py-6 overflow-y-auto main-content">
+              {currentContent && (
+                <>
+                  <h3 className="text-2xl font-semibold text-gray-900 mb-6">
+                    {currentContent.content.title}
+                  </h3>
+                  
+                  {/* Content - Proper Markdown rendering */}
+                  <MarkdownContent content={currentContent.content.content} title={currentContent.content.title} />
+                  
+                  {/* Mobile PDF, Images, and Sources - Only visible on small screens */}
+                  <div className="lg:hidden mt-8 space-y-6">
+                    {/* PDF Section */}
+                    <div>
+                      <h4 className="text-sm font-semibold text-gray-900 mb-3 flex items-center">
+                        <FileText className="w-4 h-4 mr-2" />
+                        PDF Original
+                      </h4>
+                      {currentContent?.content?.page_number ? (
+                        <div className="space-y-3">
+                          <button
+                            onClick={() => handlePdfPageView(currentContent.content.page_number!)}
+                            className="w-full bg-blue-50 p-3 rounded-lg hover:bg-blue-100 transition-colors text-left"
+                          >
+                            <div className="flex items-center space-x-2">
+                              <FileText className="w-4 h-4 text-blue-600" />
+                              <div>
+                                <p className="text-sm font-medium text-blue-700">
+                                  Page {currentContent.content.page_number}
+                                </p>
+                                <p className="text-xs text-blue-600">
+                                  Click to view full page
+                                </p>
+                              </div>
+                            </div>
+                          </button>
+                        </div>
+                      ) : (
+                        <div className="text-center py-4">
+                          <FileText className="w-8 h-8 text-gray-400 mx-auto mb-2" />
+                          <p className="text-xs text-gray-500 mb-2">No page reference available</p>
+                          <button
+                            onClick={() => window.open(`https://arxiv.org/pdf/${paperData.arxiv_id}.pdf`, '_blank', 'noopener,noreferrer')}
+                            className="px-3 py-2 bg-blue-600 text-white text-xs rounded-lg hover:bg-blue-700 transition-colors"
+                          >
+                            View Full PDF
+                          </button>
+                        </div>
+                      )}
+                    </div>
+
+                    {/* Images Section */}
+                    <div>
+                      <h4 className="text-sm font-semibold text-gray-900 mb-3 flex items-center">
+                        <ImageIcon className="w-4 h-4 mr-2" />
+                        Images
+                      </h4>
+                      {imagesLoading ? (
+                        <div className="text-center py-4">
+                          <div className="animate-spin rounded-full h-6 w-6 border-b-2 border-blue-600 mx-auto"></div>
+                          <p className="text-xs text-gray-500 mt-2">Loading images...</p>
+                        </div>
+                      ) : relevantImages.length > 0 ? (
+                        <div className="grid grid-cols-2 gap-2">
+                          {relevantImages.map((image, index) => (
+                            <div
+                              key={image.id || index}
+                              className="aspect-square bg-gray-200 rounded-lg flex items-center justify-center cursor-pointer hover:bg-gray-300 transition-colors overflow-hidden group"
+                              onClick={() => setSelectedImage(image)}
+                            >
+                              <img
+                                src={image.url || `/api/image/${image.id}`}
+                                alt={`Figure ${index + 1}`}
+                                className="max-w-full max-h-full object-contain p-1 group-hover:scale-105 transition-transform"
+                              />
+                            </div>
+                          ))}
+                        </div>
+                      ) : (
+                        <div className="text-center py-4">
+                          <ImageIcon className="w-8 h-8 text-gray-400 mx-auto mb-2" />
+                          <p className="text-xs text-gray-500">No images for this content</p>
+                        </div>
+                      )}
+                    </div>
+
+                    {/* Sources Section */}
+                    <div>
+                      <h4 className="text-sm font-semibold text-gray-900 mb-3 flex items-center">
+                        <ExternalLink className="w-4 h-4 mr-2" />
+                        Sources
+                      </h4>
+                      {contentCitations.length > 0 ? (
+                        <div className="space-y-2">
+                          {contentCitations.map((citation, index) => (
+                            <div
+                              key={index}
+                              className="bg-gray-50 p-3 rounded-lg hover:bg-gray-100 transition-colors"
+                            >
+                              <div className="flex items-start space-x-2">
+                                <div className="flex-1 min-w-0">
+                                  <p className="text-xs font-medium text-gray-900 mb-1">
+                                    Reference {index + 1}
+                                  </p>
+                                  <p className="text-xs text-gray-800 break-words">
+                                    {citation}
+                                  </p>
+                                  <button
+                                    onClick={() => handleCitationClick(citation)}
+                                    className="inline-flex items-center text-xs text-blue-600 hover:text-blue-800 hover:underline mt-2"
+                                  >
+                                    {isYouTubeUrl(citation) ? (
+                                      <Play className="w-3 h-3 mr-1" />
+                                    ) : (
+                                      <ExternalLink className="w-3 h-3 mr-1" />
+                                    )}
+                                    {isYouTubeUrl(citation) ? 'Watch Video' : 'View Source'}
+                                  </button>
+                                </div>
+                              </div>
+                            </div>
+                          ))}
+                        </div>
+                      ) : (
+                        <div className="text-center py-4">
+                          <ExternalLink className="w-8 h-8 text-gray-400 mx-auto mb-2" />
+                          <p className="text-xs text-gray-500">No citations for this content</p>
+                        </div>
+                      )}
+                    </div>
+                  </div>
+                </>
+              )}
+            </div>
+
+            {/* Right Sidebar - PDF, Images, and Sources */}
+            <aside className="w-96 bg-white flex-shrink-0 fixed top-16 bottom-0 overflow-y-auto scrollbar-hide hidden lg:block lg:right-32">
+              <div className="p-6 space-y-6">
+              
+              {/* PDF Section */}
+              <div>
+                <h4 className="text-sm font-semibold text-gray-900 mb-3 flex items-center">
+                  <FileText className="w-4 h-4 mr-2" />
+                  PDF Original
+                </h4>
+                {currentContent?.content?.page_number ? (
+                  <div className="space-y-3">
+                    <button
+                      onClick={() => handlePdfPageView(currentContent.content.page_number!)}
+                      className="w-full bg-blue-50 p-3 rounded-lg hover:bg-blue-100 transition-colors text-left"
+                    >
+                      <div className="flex items-center space-x-2">
+                        <FileText className="w-4 h-4 text-blue-600" />
+                        <div>
+                          <p className="text-sm font-medium text-blue-700">
+                            Page {currentContent.content.page_number}
+                          </p>
+                          <p className="text-xs text-blue-600">
+                            Click to view full page
+                          </p>
+                        </div>
+                      </div>
+                    </button>
+                    <div className="p-3 bg-gray-50 rounded-lg">
+                      <p className="text-xs text-gray-600 mb-2">
+                        <strong>PDF Reference:</strong>
+                      </p>
+                      <p className="text-xs text-gray-700">
+                        This content is sourced from page {currentContent.content.page_number} of the original PDF. 
+                        Click above to view the full page with figures, tables, and original formatting.
+                      </p>
+                    </div>
+                  </div>
+                ) : (
+                  <div className="text-center py-4">
+                    <FileText className="w-8 h-8 text-gray-400 mx-auto mb-2" />
+                    <p className="text-xs text-gray-500 mb-2">No page reference available</p>
+                    <button
+                      onClick={() => window.open(`https://arxiv.org/pdf/${paperData.arxiv_id}.pdf`, '_blank', 'noopener,noreferrer')}
+                      className="px-3 py-2 bg-blue-600 text-white text-xs rounded-lg hover:bg-blue-700 transition-colors"
+                    >
+                      View Full PDF
+                    </button>
+                  </div>
+                )}
+              </div>
+
+              {/* Images Section */}
+              <div>
+                <h4 className="text-sm font-semibold text-gray-900 mb-3 flex items-center">
+                  <ImageIcon className="w-4 h-4 mr-2" />
+                  Images
+                </h4>
+                {imagesLoading ? (
+                  <div className="text-center py-4">
+                    <div className="animate-spin rounded-full h-6 w-6 border-b-2 border-blue-600 mx-auto"></div>
+                    <p className="text-xs text-gray-500 mt-2">Loading images...</p>
+                  </div>
+                ) : relevantImages.length > 0 ? (
+                  <div className="grid grid-cols-2 gap-2">
+                    {relevantImages.map((image, index) => (
+                      <div
+                        key={image.id || index}
+                        className="aspect-square bg-gray-200 rounded-lg flex items-center justify-center cursor-pointer hover:bg-gray-300 transition-colors overflow-hidden group"
+                        onClick={() => setSelectedImage(image)}
+                      >
+                        <img
+                          src={image.url || `/api/image/${image.id}`}
+                          alt={`Figure ${index + 1}`}
+                          className="max-w-full max-h-full object-contain p-1 group-hover:scale-105 transition-transform"
+                        />
+                      </div>
+                    ))}
+                  </div>
+                ) : (
+                  <div className="text-center py-4">
+                    <ImageIcon className="w-8 h-8 text-gray-400 mx-auto mb-2" />
+                    <p className="text-xs text-gray-500">No images for this content</p>
+                  </div>
+                )}
+                {relevantImages.length > 0 && (
+                  <p className="text-xs text-gray-500 mt-2 text-center">
+                    Click on an image to enlarge.
+                  </p>
+                )}
+              </div>
+
+              {/* Sources Section */}
+              <div>
+                <h4 className="text-sm font-semibold text-gray-900 mb-3 flex items-center">
+                  <ExternalLink className="w-4 h-4 mr-2" />
+                  Sources
+                </h4>
+                {contentCitations.length > 0 ? (
+                  <div className="space-y-2">
+                    {contentCitations.map((citation, index) => (
+                      <div
+                        key={index}
+                        className="bg-gray-50 p-3 rounded-lg hover:bg-gray-100 transition-colors"
+                      >
+                        <div className="flex items-start space-x-2">
+                          <div className="flex-1 min-w-0">
+                            <p className="text-xs font-medium text-gray-900 mb-1">
+                              Reference {index + 1}
+                            </p>
+                            <p className="text-xs text-gray-800 break-words">
+                              {citation}
+                            </p>
+                            <button
+                              onClick={() => handleCitationClick(citation)}
+                              className="inline-flex items-center text-xs text-blue-600 hover:text-blue-800 hover:underline mt-2"
+                            >
+                              {isYouTubeUrl(citation) ? (
+                                <Play className="w-3 h-3 mr-1" />
+                              ) : (
+                                <ExternalLink className="w-3 h-3 mr-1" />
+                              )}
+                              {isYouTubeUrl(citation) ? 'Watch Video' : 'View Source'}
+                            </button>
+                          </div>
+                        </div>
+                      </div>
+                    ))}
+                  </div>
+                ) : (
+                  <div className="text-center py-4">
+                    <ExternalLink className="w-8 h-8 text-gray-400 mx-auto mb-2" />
+                    <p className="text-xs text-gray-500">No citations for this content</p>
+                  </div>
+                )}
+                </div>
+                
+              </div>
+            </aside>
+          </div>
+        </div>
+      </main>
+
+      {/* Floating Chat Button */}
+      <button
+        onClick={handleChatRedirect}
+        className="fixed bottom-6 right-6 bg-blue-600 hover:bg-blue-700 text-white px-4 py-3 rounded-lg shadow-lg transition-all duration-200 hover:scale-105 z-50 flex items-center gap-2"
+        title="Chat with this paper"
+      >
+        <MessageCircle className="w-5 h-5" />
+        <span className="text-sm font-medium">
+          Chat with this paper {paperData.arxiv_id}
+        </span>
+      </button>
+
+      {/* Image Modal with Close Button */}
+      {selectedImage && (
+        <div 
+          className="fixed inset-0 bg-black bg-opacity-75 flex items-center justify-center z-50 p-4"
+          onClick={() => setSelectedImage(null)}
+        >
+          <div className="relative max-w-4xl max-h-full" onClick={(e) => e.stopPropagation()}>
+            <button
+              onClick={() => setSelectedImage(null)}
+              className="absolute top-4 right-4 text-white hover:text-gray-300 z-10 bg-black bg-opacity-50 rounded-full p-2"
+            >
+              <X className="w-6 h-6" />
+            </button>
+            <img
+              src={selectedImage.url || `/api/image/${selectedImage.id}`}
+              alt="Enlarged figure"
+              className="max-w-full max-h-full object-contain rounded-lg"
+            />
+          </div>
+        </div>
+      )}
+
+      {/* YouTube Modal */}
+      {youtubeModal.isOpen && youtubeModal.videoId && (
+        <div className="fixed inset-0 bg-black bg-opacity-75 flex items-center justify-center z-50 p-4">
+          <div className="relative bg-white rounded-lg max-w-4xl w-full max-h-full">
+            <button
+              onClick={() => setYoutubeModal({ isOpen: false, videoId: null })}
+              className="absolute top-4 right-4 text-gray-600 hover:text-gray-800 z-10"
+            >
+              <X className="w-8 h-8" />
+            </button>
+            <div className="p-4">
+              <iframe
+                width="100%"
+                height="480"
+                src={`https://www.youtube.com/embed/${youtubeModal.videoId}`}
+                title="YouTube video player"
+                frameBorder="0"
+                allow="accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture"
+                allowFullScreen
+                className="rounded-lg"
+              ></iframe>
+            </div>
+          </div>
+        </div>
+      )}
+    </div>
+  );
+}
+"""
+        with open(os.path.join(paper_folder, "page.tsx"), "w", encoding="utf-8") as f:
+            f.write(page_content)
+        
+        print(f"Successfully created Next.js folder structure for paper {paper.arxiv_id}")
+    except Exception as e:
+        print(f"Error creating Next.js folder structure for paper {paper.arxiv_id}: {str(e)}")
+        import traceback
+        traceback.print_exc()
@@ -3,130 +3,946 @@ import cv2
 import numpy as np
 import PyPDF2
 from PIL import Image, ImageDraw, ImageFont
-from pdf2image import convert_from_bytes
 import json
 import re
 import tempfile
-import uuid
+import hashlib
+import threading
+import multiprocessing
+import atexit
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
 from dotenv import load_dotenv
 import fitz  # PyMuPDF for better text extraction with coordinates
+from paper_indexer import page_for_offset
+from blob_store import get_blob_store
+from artifact_cache import ArtifactCache
 
 # Load environment variables
 load_dotenv()
 
+# Resolution pages are rendered at for figure extraction and highlights (matches the old pdf2image default)
+RENDER_DPI = 200
+
+# Figures are located on a cheap low-resolution render; only their regions are re-rendered at RENDER_DPI
+DETECT_DPI = int(os.getenv("PDF_DETECT_DPI", "100"))
+
+# "auto" finds figures from the PDF's embedded images and vector drawings and only rasterizes pages
+# it cannot read (scanned or outlined pages); "raster" always thresholds a page render
+FIGURE_DETECTION = os.getenv("PDF_FIGURE_DETECTION", "auto").lower()
+
+# Vector drawings are clustered on a coarse occupancy grid: cell size and joining gap in PDF points
+VECTOR_GRID_POINTS = 2
+VECTOR_GAP_POINTS = 12
+
+# Raster thresholds (100px minimum size, 50px minimum expansion at RENDER_DPI) in PDF points
+MIN_FIGURE_POINTS = 100 * 72 / RENDER_DPI
+MIN_EXPANSION_POINTS = 50 * 72 / RENDER_DPI
+
+# Detections of the same figure are merged when their expanded boxes overlap (IoU or containment)
+# or their original boxes lie within the gap (PDF points) of each other
+FIGURE_IOU_THRESHOLD = float(os.getenv("PDF_FIGURE_IOU", "0.3"))
+FIGURE_CONTAINMENT_THRESHOLD = 0.9
+FIGURE_MERGE_GAP_POINTS = float(os.getenv("PDF_FIGURE_MERGE_GAP", "8"))
+
+# Optionally drop figures that repeat across pages (logos, running headers) by perceptual hash
+FIGURE_DEDUP = os.getenv("PDF_FIGURE_DEDUP", "false").lower() == "true"
+FIGURE_DEDUP_DISTANCE = 4
+
+# Chunk text is aligned to a page's word stream by anchoring on runs of this many words
+ANCHOR_TOKENS = 4
+ANCHOR_SEARCH_TOKENS = 64
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Rendered pages kept for highlight generation, and parsed documents kept per paper
+PAGE_RENDER_CACHE_MAX_BYTES = int(os.getenv("PAGE_RENDER_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DOCUMENT_CACHE_SIZE = int(os.getenv("PDF_DOCUMENT_CACHE_SIZE", "8"))
+
+# Encoding used for extracted figure crops: png, jpg or webp
+FIGURE_FORMAT = os.getenv("PDF_IMAGE_FORMAT", "png").lower().lstrip(".")
+FIGURE_QUALITY = int(os.getenv("PDF_IMAGE_QUALITY", "90"))
+
+def encode_figure(rgb_array, image_format=FIGURE_FORMAT, quality=FIGURE_QUALITY):
+    """Encode an RGB array as png/jpg/webp bytes."""
+    image_format = "jpg" if image_format == "jpeg" else image_format
+    params = []
+    if image_format == "jpg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif image_format == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    ok, buffer = cv2.imencode(f".{image_format}", cv2.cvtColor(rgb_array, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise ValueError(f"Could not encode figure as {image_format}")
+    return buffer.tobytes()
+
+class PageSpanIndex:
+    """
+    Word stream of one page built from its text spans. Each word remembers the span and
+    character range it came from, and runs of ANCHOR_TOKENS words are indexed so a chunk's
+    text can be anchored on the page in one pass instead of searching word by word.
+    """
+
+    def __init__(self, spans):
+        self.spans = spans
+        self.tokens = []
+        self.token_spans = []  # (span index, start char, end char) of each token
+        for span_index, span in enumerate(spans):
+            for match in TOKEN_PATTERN.finditer(span["text"]):
+                self.tokens.append(match.group().lower())
+                self.token_spans.append((span_index, match.start(), match.end()))
+
+        # First position of every word run on the page
+        self.anchors = {}
+        for i in range(len(self.tokens) - ANCHOR_TOKENS + 1):
+            self.anchors.setdefault(tuple(self.tokens[i:i + ANCHOR_TOKENS]), i)
+
+    def _anchor(self, chunk_tokens, offsets, min_position=0):
+        """First (chunk offset, page position) whose word run at that chunk offset occurs on the page."""
+        for offset in offsets:
+            position = self.anchors.get(tuple(chunk_tokens[offset:offset + ANCHOR_TOKENS]))
+            if position is not None and position >= min_position:
+                return offset, position
+        return None
+
+    def locate(self, text):
+        """
+        Rects (x0, y0, x1, y1 in PDF points) covering the contiguous run of page text that
+        matches `text`. The run is anchored by the first word run of the chunk found on the page
+        and ends at the last one; a chunk that continues onto the next page runs to the page end.
+        """
+        chunk_tokens = [token.lower() for token in TOKEN_PATTERN.findall(text)]
+        if len(chunk_tokens) < ANCHOR_TOKENS or not self.anchors:
+            return []
+        last_offset = len(chunk_tokens) - ANCHOR_TOKENS
+
+        start_anchor = self._anchor(chunk_tokens, range(0, min(last_offset + 1, ANCHOR_SEARCH_TOKENS)))
+        if start_anchor:
+            offset, position = start_anchor
+            start = max(0, position - offset)
+            end_anchor = self._anchor(
+                chunk_tokens, range(last_offset, max(offset, last_offset - ANCHOR_SEARCH_TOKENS), -1), position
+            )
+            if end_anchor:
+                end = end_anchor[1] + ANCHOR_TOKENS + (last_offset - end_anchor[0])
+            else:
+                end = start + len(chunk_tokens)
+        else:
+            # The chunk began on the previous page; look for where it ends on this one
+            end_anchor = self._anchor(chunk_tokens, range(last_offset, max(-1, last_offset - ANCHOR_SEARCH_TOKENS), -1))
+            if not end_anchor:
+                return []
+            end = end_anchor[1] + ANCHOR_TOKENS + (last_offset - end_anchor[0])
+            start = max(0, end - len(chunk_tokens))
+
+        return self._rects(start, min(end, len(self.tokens)))
+
+    def _rects(self, start, end):
+        # Character range covered within each span
+        covered = {}
+        for span_index, char_start, char_end in self.token_spans[start:end]:
+            first, last = covered.get(span_index, (char_start, char_end))
+            covered[span_index] = (min(first, char_start), max(last, char_end))
+
+        rects = []
+        last_line = None
+        for span_index in sorted(covered):
+            span = self.spans[span_index]
+            char_start, char_end = covered[span_index]
+            x0, y0, x1, y1 = span["bbox"]
+            length = max(len(span["text"]), 1)
+            rect = [x0 + (x1 - x0) * char_start / length, y0, x0 + (x1 - x0) * char_end / length, y1]
+
+            line = (span["block"], span["line"])
+            if rects and line == last_line:
+                # Extend the previous rect along the same line
+                rects[-1] = [min(rects[-1][0], rect[0]), min(rects[-1][1], rect[1]), max(rects[-1][2], rect[2]), max(rects[-1][3], rect[3])]
+            else:
+                rects.append(rect)
+            last_line = line
+        return [tuple(rect) for rect in rects]
+
+class PDFFile:
+    """
+    A paper's PDF stored as a file (see the blob store). Accepted wherever PDF bytes are:
+    PyMuPDF opens it by path and pages it in on demand, so the PDF never has to be read into
+    Python memory. The document and artifact caches key on its SHA-256, which is computed lazily
+    unless the caller already knows it (the blob store records it per paper).
+    """
+
+    def __init__(self, path, size=None, sha256=None):
+        self.path = path
+        self.size = size if size is not None else os.path.getsize(path)
+        self._sha256 = sha256
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def sha256(self):
+        if self._sha256 is None:
+            digest = hashlib.sha256()
+            with open(self.path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            self._sha256 = digest.hexdigest()
+        return self._sha256
+
+    def open(self):
+        return open(self.path, "rb")
+
+def load_stored_pdf(blob_key, size=None, sha256=None, fallback=None, label=None):
+    """
+    A paper's PDF for the PDF processor: a PDFFile opened from the blob store without reading it
+    into memory, bytes from non-local blob stores, or whatever `fallback()` returns (the legacy
+    pdf_data column of unmigrated rows) when there is no blob.
+    """
+    if blob_key:
+        blob_store = get_blob_store()
+        path = blob_store.local_path(blob_key)
+        if path:
+            return PDFFile(path, size, sha256)
+        pdf_data = blob_store.get(blob_key)
+        if pdf_data:
+            return pdf_data
+        print(f"⚠️ PDF blob {blob_key} for {label or 'paper'} is missing")
+    return fallback() if fallback else None
+
+def pdf_digest(pdf_data):
+    """SHA-256 of a PDF given as bytes or a PDFFile."""
+    if isinstance(pdf_data, PDFFile):
+        return pdf_data.sha256
+    return hashlib.sha256(pdf_data).hexdigest()
+
+class PDFDocument:
+    """
+    A PDF parsed once with PyMuPDF. Page text, first-pages text, page geometry and
+    page renderings all come from this one handle, so an ingestion only parses the bytes once.
+    """
+
+    def __init__(self, pdf_data):
+        self._source = pdf_data
+        self._sha256 = None
+        if isinstance(pdf_data, PDFFile):
+            self.doc = fitz.open(pdf_data.path, filetype="pdf")
+        else:
+            self.doc = fitz.open(stream=pdf_data, filetype="pdf")
+        self._page_texts = None
+        self._span_indexes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.doc.close()
+
+    @property
+    def sha256(self):
+        """Content hash of the PDF this document was opened from."""
+        if self._sha256 is None:
+            self._sha256 = pdf_digest(self._source)
+        return self._sha256
+
+    @property
+    def page_count(self):
+        return self.doc.page_count
+
+    def page_texts(self):
+        """Plain text of every page, extracted once and reused."""
+        if self._page_texts is None:
+            self._page_texts = [self.doc.load_page(page_num).get_text() for page_num in range(self.doc.page_count)]
+        return self._page_texts
+
+    def text_and_page_offsets(self):
+        """Full text with pages separated by blank lines, plus the start offset of each page."""
+        text_parts = []
+        page_offsets = []
+        position = 0
+        for page_text in self.page_texts():
+            page_text = page_text + "\n\n"
+            page_offsets.append(position)
+            text_parts.append(page_text)
+            position += len(page_text)
+        return "".join(text_parts), page_offsets
+
+    def first_pages_text(self, num_pages=4):
+        """Text from the first few pages (or all pages if there are fewer)."""
+        return "".join(page_text + "\n\n" for page_text in self.page_texts()[:num_pages])
+
+    def page_spans(self, page_num):
+        """Text spans of a page in reading order, each with its bbox and block/line numbers."""
+        spans = []
+        blocks = self.doc.load_page(page_num).get_text("dict")
+        for block_num, block in enumerate(blocks["blocks"]):
+            for line_num, line in enumerate(block.get("lines", [])):
+                for span in line["spans"]:
+                    spans.append({
+                        "text": span["text"],
+                        "bbox": tuple(span["bbox"]),  # (x0, y0, x1, y1)
+                        "block": block_num,
+                        "line": line_num
+                    })
+        return spans
+
+    def span_index(self, page_num):
+        """Word/span index of a page, built on first use and kept for the life of the document."""
+        if page_num not in self._span_indexes:
+            self._span_indexes[page_num] = PageSpanIndex(self.page_spans(page_num))
+        return self._span_indexes[page_num]
+
+    def page_size(self, page_num):
+        """Page width and height in PDF points."""
+        rect = self.doc.load_page(page_num).rect
+        return rect.width, rect.height
+
+    def render_page(self, page_num, dpi=RENDER_DPI):
+        """Render a page to an RGB PIL image."""
+        pixmap = self.doc.load_page(page_num).get_pixmap(dpi=dpi, alpha=False)
+        return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+    def render_page_array(self, page_num, dpi=RENDER_DPI):
+        """
+        Render a page to an RGB NumPy array (height x width x 3) that views the pixmap's
+        sample buffer directly, with no image encode/decode in between.
+        """
+        pixmap = self.doc.load_page(page_num).get_pixmap(dpi=dpi, alpha=False)
+        return self._pixmap_array(pixmap)
+
+    def render_clip_array(self, page_num, clip, dpi=RENDER_DPI):
+        """Render only the `clip` rectangle (x0, y0, x1, y1 in PDF points) of a page to an RGB NumPy array."""
+        pixmap = self.doc.load_page(page_num).get_pixmap(dpi=dpi, clip=fitz.Rect(clip), alpha=False)
+        return self._pixmap_array(pixmap)
+
+    @staticmethod
+    def _pixmap_array(pixmap):
+        if not hasattr(pixmap, "samples_ptr"):
+            return np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+        return np.asarray(_PixmapSamples(pixmap))
+
+class _PixmapSamples:
+    """
+    Exposes a pixmap's sample buffer to NumPy without copying. The array keeps this object,
+    and with it the pixmap, alive; a bare samples_mv view would dangle once the pixmap is freed.
+    """
+
+    def __init__(self, pixmap):
+        self.pixmap = pixmap
+        self.__array_interface__ = {
+            "shape": (pixmap.height, pixmap.width, pixmap.n),
+            "strides": (pixmap.stride, pixmap.n, 1),
+            "typestr": "|u1",
+            "data": (pixmap.samples_ptr, False),
+            "version": 3
+        }
+
+class PageRenderCache:
+    """
+    In-memory LRU of rendered pages keyed by (arxiv_id, pdf sha256, page, dpi), evicted by the bytes
+    of the decoded bitmaps, so repeated highlights on a page skip rasterization.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or PAGE_RENDER_CACHE_MAX_BYTES
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(image):
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, key):
+        with self._lock:
+            image = self._entries.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key, image):
+        size = self._size(image)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= self._size(previous)
+            self._entries[key] = image
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._size(evicted)
+                self.evictions += 1
+
+    def invalidate(self, arxiv_id):
+        """Drop every cached page of a paper."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == arxiv_id]:
+                self._bytes -= self._size(self._entries.pop(key))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions
+            }
+
+class DocumentCache:
+    """
+    Parsed PDFDocuments of the most recently used papers. PyMuPDF documents are not
+    thread-safe, so each one is only handed out under its own lock.
+    """
+
+    def __init__(self, max_documents=None):
+        self.max_documents = max_documents or DOCUMENT_CACHE_SIZE
+        self._entries = OrderedDict()  # arxiv_id -> (document, pdf sha256, lock)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def document(self, arxiv_id, pdf_data):
+        digest = pdf_digest(pdf_data)
+        with self._lock:
+            entry = self._entries.get(arxiv_id)
+            if entry is not None and entry[1] != digest:
+                # The paper's PDF was replaced since it was cached
+                self._close(self._entries.pop(arxiv_id))
+                entry = None
+            if entry is None:
+                entry = (PDFDocument(pdf_data), digest, threading.Lock())
+                self._entries[arxiv_id] = entry
+                while len(self._entries) > self.max_documents:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._close(evicted)
+            self._entries.move_to_end(arxiv_id)
+
+        document, _, document_lock = entry
+        with document_lock:
+            yield document
+
+    def invalidate(self, arxiv_id):
+        with self._lock:
+            entry = self._entries.pop(arxiv_id, None)
+            if entry is not None:
+                self._close(entry)
+
+    @staticmethod
+    def _close(entry):
+        document, _, document_lock = entry
+        # Wait for any request still using the document
+        with document_lock:
+            document.close()
+
+def _raster_figure_boxes(document, page_num, dpi=DETECT_DPI):
+    """
+    Find figure candidates by thresholding a page render and keeping large contours.
+    Returns (original, expanded) box pairs as (x0, y0, x1, y1) in PDF points.
+    """
+    img = document.render_page_array(page_num, dpi=dpi)
+    img_height, img_width = img.shape[:2]
+
+    # Size limits were tuned on RENDER_DPI renders; scale them to the detection resolution
+    scale = dpi / RENDER_DPI
+    min_size = 100 * scale
+    min_expansion = int(50 * scale)
+    to_points = 72 / dpi
+
+    # Convert to grayscale for processing
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+
+    # Apply threshold to get binary image
+    _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
+
+    # Find contours
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Filter contours by size to identify potential images
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+
+        # Filter small contours
+        if w > min_size and h > min_size:
+            # Expand the bounding box to include more context (axes, labels, etc.)
+            # Calculate expansion amount (greater of 20% of width/height or fixed pixels)
+            x_expansion = max(int(w * 0.20), min_expansion)
+            y_expansion = max(int(h * 0.20), min_expansion)
+
+            # Create expanded coordinates
+            x_expanded = max(0, x - x_expansion)
+            y_expanded = max(0, y - y_expansion)
+            w_expanded = min(img_width - x_expanded, w + 2 * x_expansion)
+            h_expanded = min(img_height - y_expanded, h + 2 * y_expansion)
+
+            original = (x, y, x + w, y + h)
+            expanded = (x_expanded, y_expanded, x_expanded + w_expanded, y_expanded + h_expanded)
+            boxes.append((
+                tuple(v * to_points for v in original),
+                tuple(v * to_points for v in expanded)
+            ))
+    return boxes
+
+def _expand_box(box, page_width, page_height):
+    """Expand a box in PDF points the same way as raster boxes (20% or 50px at RENDER_DPI), clamped to the page."""
+    x0, y0, x1, y1 = box
+    x_expansion = max((x1 - x0) * 0.20, MIN_EXPANSION_POINTS)
+    y_expansion = max((y1 - y0) * 0.20, MIN_EXPANSION_POINTS)
+    return (
+        max(0, x0 - x_expansion),
+        max(0, y0 - y_expansion),
+        min(page_width, x1 + x_expansion),
+        min(page_height, y1 + y_expansion)
+    )
+
+def _vector_figure_boxes(document, page_num):
+    """
+    Find figures from the page structure: embedded image placements plus clusters of vector
+    drawings. Thin straight strokes (table rules, fraction bars, underlines) can join a cluster
+    but never make one on their own. Returns (original, expanded) box pairs in PDF points, or
+    None when the page cannot be read this way and needs raster detection.
+    """
+    page = document.doc.load_page(page_num)
+    page_width, page_height = page.rect.width, page.rect.height
+    page_area = page_width * page_height
+
+    # No text layer usually means a scanned or fully outlined page
+    if not document.page_texts()[page_num].strip():
+        return None
+
+    cols = max(1, int(np.ceil(page_width / VECTOR_GRID_POINTS)))
+    rows = max(1, int(np.ceil(page_height / VECTOR_GRID_POINTS)))
+    occupied = np.zeros((rows, cols), dtype=np.uint8)
+    content = np.zeros((rows, cols), dtype=bool)
+
+    def mark(rect, is_content):
+        x0, y0, x1, y1 = rect
+        c0 = min(cols - 1, max(0, int(x0 // VECTOR_GRID_POINTS)))
+        r0 = min(rows - 1, max(0, int(y0 // VECTOR_GRID_POINTS)))
+        c1 = max(c0 + 1, min(cols, int(np.ceil(x1 / VECTOR_GRID_POINTS))))
+        r1 = max(r0 + 1, min(rows, int(np.ceil(y1 / VECTOR_GRID_POINTS))))
+        occupied[r0:r1, c0:c1] = 1
+        if is_content:
+            content[r0:r1, c0:c1] = True
+
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        if (x1 - x0) * (y1 - y0) > 0.8 * page_area:
+            # A page-sized image is a scan; its figures are only visible in the pixels
+            return None
+        mark((x0, y0, x1, y1), True)
+
+    for drawing in page.get_drawings():
+        rect = drawing["rect"]
+        if rect.width * rect.height > 0.8 * page_area:
+            continue  # Page backgrounds and frames
+        mark(tuple(rect), rect.width > 1.5 and rect.height > 1.5)
+
+    if not content.any():
+        return []
+
+    # Join drawings closer than the gap, then measure each group on the undilated grid
+    gap_cells = max(1, VECTOR_GAP_POINTS // VECTOR_GRID_POINTS)
+    joined = cv2.dilate(occupied, np.ones((2 * gap_cells + 1, 2 * gap_cells + 1), dtype=np.uint8))
+    count, labels = cv2.connectedComponents(joined)
+
+    boxes = []
+    for label in range(1, count):
+        component = labels == label
+        if not content[component].any():
+            continue
+        ys, xs = np.nonzero(component & occupied.astype(bool))
+        original = (
+            float(xs.min() * VECTOR_GRID_POINTS),
+            float(ys.min() * VECTOR_GRID_POINTS),
+            float(min(page_width, (xs.max() + 1) * VECTOR_GRID_POINTS)),
+            float(min(page_height, (ys.max() + 1) * VECTOR_GRID_POINTS))
+        )
+        if original[2] - original[0] > MIN_FIGURE_POINTS and original[3] - original[1] > MIN_FIGURE_POINTS:
+            boxes.append((original, _expand_box(original, page_width, page_height)))
+    return boxes
+
+def merge_figure_boxes(boxes, page_width, page_height, iou_threshold=FIGURE_IOU_THRESHOLD,
+                       merge_gap=FIGURE_MERGE_GAP_POINTS):
+    """
+    Collapse (original, expanded) box pairs that belong to the same figure. Boxes are linked when
+    their expanded boxes have IoU above `iou_threshold` or one mostly contains the other, or when
+    their original boxes are within `merge_gap` points; each linked group becomes the union of its
+    originals, expanded again. Repeats until nothing links, and returns boxes in reading order.
+    """
+    while len(boxes) > 1:
+        originals = np.array([box[0] for box in boxes], dtype=np.float64)
+        expanded = np.array([box[1] for box in boxes], dtype=np.float64)
+
+        # Pairwise intersection of expanded boxes
+        inter_w = np.clip(np.minimum(expanded[:, None, 2], expanded[None, :, 2]) - np.maximum(expanded[:, None, 0], expanded[None, :, 0]), 0, None)
+        inter_h = np.clip(np.minimum(expanded[:, None, 3], expanded[None, :, 3]) - np.maximum(expanded[:, None, 1], expanded[None, :, 1]), 0, None)
+        intersection = inter_w * inter_h
+        areas = np.maximum((expanded[:, 2] - expanded[:, 0]) * (expanded[:, 3] - expanded[:, 1]), 1e-6)
+        iou = intersection / (areas[:, None] + areas[None, :] - intersection)
+        containment = intersection / np.minimum(areas[:, None], areas[None, :])
+
+        # Gap between original boxes: the larger of the horizontal and vertical separation
+        gap_x = np.maximum(originals[:, None, 0] - originals[None, :, 2], originals[None, :, 0] - originals[:, None, 2])
+        gap_y = np.maximum(originals[:, None, 1] - originals[None, :, 3], originals[None, :, 1] - originals[:, None, 3])
+        gap = np.maximum(gap_x, gap_y)
+
+        linked = (iou > iou_threshold) | (containment > FIGURE_CONTAINMENT_THRESHOLD) | (gap <= merge_gap)
+        np.fill_diagonal(linked, False)
+        if not linked.any():
+            break
+
+        # Union-find over linked pairs
+        parent = list(range(len(boxes)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in np.argwhere(np.triu(linked)):
+            parent[find(int(i))] = find(int(j))
+
+        groups = {}
+        for i in range(len(boxes)):
+            groups.setdefault(find(i), []).append(i)
+
+        boxes = []
+        for members in groups.values():
+            union = (
+                float(originals[members, 0].min()),
+                float(originals[members, 1].min()),
+                float(originals[members, 2].max()),
+                float(originals[members, 3].max())
+            )
+            boxes.append((union, _expand_box(union, page_width, page_height)))
+
+    return sorted(boxes, key=lambda box: (box[0][1], box[0][0]))
+
+def figure_hash(rgb_array):
+    """64-bit difference hash of a crop, as 16 hex characters."""
+    gray = cv2.cvtColor(rgb_array, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return f"{int(''.join('1' if bit else '0' for bit in bits), 2):016x}"
+
+def dedup_figures(images, max_distance=FIGURE_DEDUP_DISTANCE):
+    """
+    Keep the first of any figures (in page order) whose hashes are within `max_distance` bits.
+    Dropped figures' blobs are left in place: the store is content-addressed and may share them.
+    """
+    kept = []
+    kept_hashes = []
+    for image in images:
+        image_hash = image.get("hash")
+        if image_hash:
+            value = int(image_hash, 16)
+            if any(bin(value ^ other).count("1") <= max_distance for other in kept_hashes):
+                continue
+            kept_hashes.append(value)
+        kept.append(image)
+    return kept
+
+def make_figure_id(doc_key, page_num, bbox):
+    """
+    Stable figure ID from the paper, page and crop box, so re-extracting a paper
+    (on any worker, after any restart) yields the IDs already stored for it.
+    """
+    key = "\x1f".join([doc_key, str(page_num), ",".join(f"{v:.1f}" for v in bbox)])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+def _pixel_position(box, dpi=RENDER_DPI):
+    """Convert a box in PDF points to the {x, y, width, height} pixel dict used in image records."""
+    x0, y0, x1, y1 = (int(round(v * dpi / 72)) for v in box)
+    return {"x": x0, "y": y0, "width": x1 - x0, "height": y1 - y0}
+
+def _detect_page_figures(document, page_num, doc_key, image_format=FIGURE_FORMAT):
+    """
+    Detect figure regions on one page and save each crop to the blob store.
+    Figures come from the PDF structure when possible, otherwise from a DETECT_DPI render;
+    each figure is then rendered alone at RENDER_DPI through a clip rectangle.
+    Module-level so it can run both in the API process and in figure-extraction pool workers.
+    """
+    page_images = []
+    try:
+        boxes, detection = None, "vector"
+        if FIGURE_DETECTION != "raster":
+            boxes = _vector_figure_boxes(document, page_num)
+        if boxes is None:
+            boxes, detection = _raster_figure_boxes(document, page_num), "raster"
+
+        # One crop per figure, merged before anything is rendered at full resolution
+        page_width, page_height = document.page_size(page_num)
+        boxes = merge_figure_boxes(boxes, page_width, page_height)
+
+        for original, expanded in boxes:
+            # High-resolution render of just the figure region; only this crop gets encoded
+            roi = document.render_clip_array(page_num, expanded)
+
+            # Save the extracted image under its content hash
+            bbox = [round(v, 2) for v in expanded]
+            image_id = make_figure_id(doc_key, page_num, bbox)
+            blob_key = get_blob_store().put(encode_figure(roi, image_format), image_format)
+
+            # Positions stay in RENDER_DPI pixels as before; bbox is the crop in PDF points
+            page_images.append({
+                "id": image_id,
+                "page": page_num,
+                "original_position": _pixel_position(original),
+                "expanded_position": _pixel_position(expanded),
+                "bbox": bbox,
+                "blob_key": blob_key,
+                "path": get_blob_store().local_path(blob_key),
+                "format": image_format,
+                "detection": detection,
+                "hash": figure_hash(roi)
+            })
+    except Exception as e:
+        print(f"Error extracting images from page {page_num}: {str(e)}")
+    return page_images
+
+# Pool workers keep the last few PDFs they were sent open, so each parses a paper once and then handles many pages
+_worker_documents = OrderedDict()  # pdf path -> PDFDocument
+_WORKER_DOCUMENTS = 2
+
+def _extract_page_figures_in_worker(pdf_path, page_num, doc_key, image_format):
+    document = _worker_documents.get(pdf_path)
+    if document is None:
+        document = PDFDocument(PDFFile(pdf_path))
+        _worker_documents[pdf_path] = document
+        while len(_worker_documents) > _WORKER_DOCUMENTS:
+            _worker_documents.popitem(last=False)[1].close()
+    _worker_documents.move_to_end(pdf_path)
+    return page_num, _detect_page_figures(document, page_num, doc_key, image_format)
+
+# One figure extraction pool per process, started on first use so workers import cv2/fitz only once
+_figure_pool = None
+_figure_pool_lock = threading.Lock()
+
+def _get_figure_pool(workers):
+    global _figure_pool
+    with _figure_pool_lock:
+        if _figure_pool is None:
+            # Spawn rather than fork: this often runs from a thread of the API process
+            _figure_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _figure_pool
+
+def _reset_figure_pool(pool):
+    """Drop a pool whose worker died so the next paper starts a fresh one."""
+    global _figure_pool
+    with _figure_pool_lock:
+        if _figure_pool is pool:
+            _figure_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+@atexit.register
+def _shutdown_figure_pool():
+    with _figure_pool_lock:
+        if _figure_pool is not None:
+            _figure_pool.shutdown(cancel_futures=True)
+
 class PDFProcessor:
-    def __init__(self):
+    def __init__(self, image_workers=None):
         self.temp_dir = tempfile.mkdtemp()
         
+        # Worker processes for page-sharded figure extraction (1 = extract in-process)
+        self.image_workers = image_workers or int(os.getenv("PDF_IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.image_format = FIGURE_FORMAT
+        
+        # Highlight rendering reuses parsed documents and page bitmaps across requests
+        self.page_cache = PageRenderCache()
+        self.document_cache = DocumentCache()
+        
+        # Highlighted pages and page renders on disk, shared by identical requests
+        self.artifacts = ArtifactCache()
+        
     def extract_text_from_pdf(self, pdf_data):
         """Extract text from PDF binary data."""
-        text = ""
+        text, _ = self.extract_text_and_page_offsets(pdf_data)
+        return text
+    
+    def extract_text_and_page_offsets(self, pdf_data):
+        """
+        Extract text from PDF binary data along with the character offset where each page starts.
+        page_offsets[i] is the index in the returned text of the first character of page i.
+        """
         try:
-            # Create a PDF reader object
-            pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_data))
-            
-            # Extract text from each page
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n\n"
+            with PDFDocument(pdf_data) as document:
+                return document.text_and_page_offsets()
+        except Exception as e:
+            print(f"Error extracting text: {str(e)}")
+            return "", []
+    
+    def extract_legacy_text_and_page_offsets(self, pdf_data):
+        """
+        Same as extract_text_and_page_offsets but using PyPDF2, which produced the text
+        stored for papers processed before extraction moved to PyMuPDF.
+        """
+        text_parts = []
+        page_offsets = []
+        position = 0
+        try:
+            # Create a PDF reader object; stored PDFs are read straight from their file
+            with (pdf_data.open() if isinstance(pdf_data, PDFFile) else BytesIO(pdf_data)) as stream:
+                pdf_reader = PyPDF2.PdfReader(stream)
                 
-            return text
+                # Extract text from each page, remembering where it starts
+                for page_num in range(len(pdf_reader.pages)):
+                    page = pdf_reader.pages[page_num]
+                    page_text = (page.extract_text() or "") + "\n\n"
+                    page_offsets.append(position)
+                    text_parts.append(page_text)
+                    position += len(page_text)
+                
+            return "".join(text_parts), page_offsets
         except Exception as e:
             print(f"Error extracting text: {str(e)}")
-            return ""
+            return "", []
     
     def extract_text_from_first_pages(self, pdf_data, num_pages=4):
         """Extract text from the first few pages of a PDF."""
-        text = ""
         try:
-            # Create a PDF reader object
-            pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_data))
-            
-            # Get total number of pages
-            total_pages = len(pdf_reader.pages)
-            
-            # Extract text from specified number of pages (or all if fewer)
-            for page_num in range(min(num_pages, total_pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n\n"
-                
-            return text
+            with PDFDocument(pdf_data) as document:
+                return document.first_pages_text(num_pages)
         except Exception as e:
             print(f"Error extracting first pages: {str(e)}")
             return ""
     
-    def extract_images_from_pdf(self, pdf_data):
-        """Extract images from PDF binary data using pdf2image and OpenCV."""
-        images_data = []
+    def iter_images_from_pdf(self, pdf_data, document=None, workers=None, arxiv_id=None):
+        """
+        Yield (page_number, images) for each page as its figure extraction completes.
+        With more than one worker, pages are fanned out to a process pool and may finish out of order.
+        Figure IDs derive from `arxiv_id` (or the PDF's hash), the page and the crop box.
+        """
+        workers = workers or self.image_workers
+        own_document = document is None
+        doc_key = arxiv_id or pdf_digest(pdf_data)
+        temp_pdf_path = None
         
         try:
-            # Convert PDF to images
-            pages = convert_from_bytes(pdf_data)
+            if own_document:
+                document = PDFDocument(pdf_data)
+            page_count = document.page_count
             
-            for i, page in enumerate(pages):
-                # Save page as temporary image
-                img_path = os.path.join(self.temp_dir, f"page_{i}.png")
-                page.save(img_path, "PNG")
-                
-                # Read image with OpenCV
-                img = cv2.imread(img_path)
-                img_height, img_width = img.shape[:2]
-                
-                # Convert to grayscale for processing
-                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                
-                # Apply threshold to get binary image
-                _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
-                
-                # Find contours
-                contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                
-                # Filter contours by size to identify potential images
-                for j, contour in enumerate(contours):
-                    x, y, w, h = cv2.boundingRect(contour)
-                    
-                    # Filter small contours
-                    if w > 100 and h > 100:
-                        # Expand the bounding box to include more context (axes, labels, etc.)
-                        # Calculate expansion amount (greater of 20% of width/height or fixed pixels)
-                        x_expansion = max(int(w * 0.20), 50)
-                        y_expansion = max(int(h * 0.20), 50)
-                        
-                        # Create expanded coordinates
-                        x_expanded = max(0, x - x_expansion)
-                        y_expanded = max(0, y - y_expansion)
-                        w_expanded = min(img_width - x_expanded, w + 2 * x_expansion)
-                        h_expanded = min(img_height - y_expanded, h + 2 * y_expansion)
-                        
-                        # Extract the region with expanded bounds
-                        roi = img[y_expanded:y_expanded+h_expanded, x_expanded:x_expanded+w_expanded]
-                        
-                        # Save the extracted image
-                        image_id = str(uuid.uuid4())
-                        extracted_img_path = os.path.join(self.temp_dir, f"image_{image_id}.png")
-                        cv2.imwrite(extracted_img_path, roi)
-                        
-                        # Add to results with original and expanded position data
-                        images_data.append({
-                            "id": image_id,
-                            "page": i,
-                            "original_position": {"x": x, "y": y, "width": w, "height": h},
-                            "expanded_position": {"x": x_expanded, "y": y_expanded, "width": w_expanded, "height": h_expanded},
-                            "path": extracted_img_path
-                        })
+            if workers <= 1 or page_count < 2:
+                for page_num in range(page_count):
+                    yield page_num, _detect_page_figures(document, page_num, doc_key, self.image_format)
+                return
+            
+            # Workers open the PDF by path; PDFs held in memory are spilled to a temp file first
+            if isinstance(pdf_data, PDFFile):
+                pdf_path = pdf_data.path
+            else:
+                fd, temp_pdf_path = tempfile.mkstemp(suffix=".pdf", dir=self.temp_dir)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(pdf_data)
+                pdf_path = temp_pdf_path
+            
+            print(f"Extracting figures from {page_count} pages in the shared worker pool")
+            executor = _get_figure_pool(workers)
+            futures = {}  # future -> page number
+            finished = set()
+            pool_failed = False
+            try:
+                for page_num in range(page_count):
+                    futures[executor.submit(
+                        _extract_page_figures_in_worker, pdf_path, page_num, doc_key, self.image_format
+                    )] = page_num
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:
+                        print(f"Error in figure extraction worker: {str(e)}")
+                        result = None
+                    finished.add(futures[future])
+                    if result is not None:
+                        yield result
+            except BrokenProcessPool as e:
+                print(f"Figure extraction pool failed: {str(e)}")
+                _reset_figure_pool(executor)
+                pool_failed = True
+            finally:
+                # Pages still queued when the caller stops early are dropped
+                for future in futures:
+                    future.cancel()
             
+            if pool_failed:
+                # Finish the pages the pool never returned in this process rather than dropping them
+                remaining = [page_num for page_num in range(page_count) if page_num not in finished]
+                print(f"Extracting figures from the remaining {len(remaining)} pages in-process")
+                for page_num in remaining:
+                    yield page_num, _detect_page_figures(document, page_num, doc_key, self.image_format)
+        finally:
+            if own_document and document is not None:
+                document.close()
+            if temp_pdf_path:
+                try:
+                    os.remove(temp_pdf_path)
+                except OSError:
+                    pass
+    
+    def extract_images_from_pdf(self, pdf_data, document=None, workers=None, arxiv_id=None):
+        """Extract images from PDF binary data using PyMuPDF renders and OpenCV, merged in page order."""
+        images_by_page = {}
+        
+        try:
+            for page_num, page_images in self.iter_images_from_pdf(pdf_data, document=document, workers=workers, arxiv_id=arxiv_id):
+                images_by_page[page_num] = page_images
+            
+            images_data = []
+            for page_num in sorted(images_by_page):
+                images_data.extend(images_by_page[page_num])
+            
+            if FIGURE_DEDUP:
+                before = len(images_data)
+                images_data = dedup_figures(images_data)
+                print(f"Dropped {before - len(images_data)} duplicate figures across pages")
             return images_data
         except Exception as e:
             print(f"Error extracting images: {str(e)}")
             return []
     
-    def process_pdf(self, pdf_data):
-        """Process PDF and extract text and images."""
-        result = {
-            "text": self.extract_text_from_pdf(pdf_data),
-            "images": self.extract_images_from_pdf(pdf_data)
-        }
+    def regenerate_figure(self, pdf_data, page_num, bbox, image_format=None):
+        """
+        Re-render one stored figure from its page and crop box (PDF points) and return its blob key.
+        Only that clip is rasterized, so a missing figure costs one small render, not a whole paper.
+        """
+        image_format = image_format or self.image_format
+        with PDFDocument(pdf_data) as document:
+            roi = document.render_clip_array(page_num, bbox)
+        return get_blob_store().put(encode_figure(roi, image_format), image_format)
+    
+    def process_pdf(self, pdf_data, first_pages=4, arxiv_id=None):
+        """
+        Process PDF and extract text, per-page text offsets, first-pages text for metadata and images.
+        The PDF is parsed once and every step reads from the same document.
+        """
+        with PDFDocument(pdf_data) as document:
+            text, page_offsets = document.text_and_page_offsets()
+            result = {
+                "text": text,
+                "page_offsets": page_offsets,
+                "first_pages_text": document.first_pages_text(first_pages),
+                "page_count": document.page_count,
+                "images": self.extract_images_from_pdf(pdf_data, document=document, arxiv_id=arxiv_id)
+            }
         return result
         
     def extract_arxiv_id(self, url):
@@ -138,168 +954,170 @@ class PDFProcessor:
             return match.group(1)
         return None
 
-    def extract_text_with_coordinates(self, pdf_data):
-        """Extract text with coordinates using PyMuPDF for better text positioning."""
-        try:
-            doc = fitz.open(stream=pdf_data, filetype="pdf")
-            text_blocks = []
-            
-            for page_num in range(doc.page_count):
-                page = doc.load_page(page_num)
-                blocks = page.get_text("dict")
-                
-                page_text = ""
-                for block in blocks["blocks"]:
-                    if "lines" in block:
-                        for line in block["lines"]:
-                            for span in line["spans"]:
-                                text = span["text"]
-                                bbox = span["bbox"]  # (x0, y0, x1, y1)
-                                page_text += text
-                                
-                                text_blocks.append({
-                                    "text": text,
-                                    "page": page_num,
-                                    "bbox": bbox,
-                                    "page_text_position": len(page_text) - len(text)
-                                })
-                            page_text += " "
-                        page_text += "\n"
-                
-            doc.close()
-            return text_blocks
-        except Exception as e:
-            print(f"Error extracting text with coordinates: {str(e)}")
-            return []
+    def _find_highlight_rects(self, document, page_num, text_to_highlight):
+        """Rects (PDF points) on the page covering the chunk's own text, from the cached span index."""
+        return document.span_index(page_num).locate(text_to_highlight)
+    
+    def render_page_cached(self, document, page_num, arxiv_id=None, dpi=RENDER_DPI):
+        """Render a page through the page cache when the paper is known."""
+        if not arxiv_id:
+            return document.render_page(page_num, dpi)
+        # The document's hash keeps renders of a replaced PDF from being served
+        key = (arxiv_id, document.sha256, page_num, dpi)
+        page_image = self.page_cache.get(key)
+        if page_image is None:
+            page_image = document.render_page(page_num, dpi)
+            self.page_cache.put(key, page_image)
+        return page_image
+    
+    def invalidate_paper_caches(self, arxiv_id):
+        """Forget cached documents and page renders of a paper whose PDF is being reprocessed."""
+        self.document_cache.invalidate(arxiv_id)
+        self.page_cache.invalidate(arxiv_id)
 
-    def create_highlighted_page_image(self, pdf_data, page_num, text_to_highlight, output_path):
-        """Create a highlighted page image showing the specified text in yellow."""
-        try:
-            # Convert PDF page to image
-            pages = convert_from_bytes(pdf_data, first_page=page_num+1, last_page=page_num+1, dpi=200)
-            if not pages:
-                print(f"No pages found for page number {page_num+1}")
-                return None
-                
-            page_image = pages[0]
-            
-            # Extract text with coordinates using PyMuPDF
-            doc = fitz.open(stream=pdf_data, filetype="pdf")
-            
-            # Check if page number is valid
-            if page_num >= doc.page_count:
-                print(f"Page number {page_num} is out of range. Document has {doc.page_count} pages.")
-                doc.close()
-                return None
-                
-            pdf_page = doc.load_page(page_num)
-            
-            # Search for text occurrences
-            text_instances = []
-            words_to_highlight = text_to_highlight.split()[:10]  # Limit to first 10 words for better matching
-            
-            for word in words_to_highlight:
-                if len(word) > 3:  # Only search for words longer than 3 chars
-                    instances = pdf_page.search_for(word)
-                    text_instances.extend(instances)
-            
-            # Get page dimensions for scaling
-            pdf_width = pdf_page.rect.width
-            pdf_height = pdf_page.rect.height
-            
-            doc.close()
-            
-            # Convert to PIL for highlighting
-            img = page_image.convert("RGBA")
-            overlay = Image.new("RGBA", img.size, (255, 255, 255, 0))
-            draw = ImageDraw.Draw(overlay)
-            
-            # Scale coordinates from PDF to image
-            img_width, img_height = img.size
-            
-            x_scale = img_width / pdf_width
-            y_scale = img_height / pdf_height
-            
-            # Draw highlights
-            for rect in text_instances:
-                x0, y0, x1, y1 = rect
-                # Scale coordinates
-                x0 *= x_scale
-                y0 *= y_scale
-                x1 *= x_scale
-                y1 *= y_scale
-                
-                # Draw yellow highlight
-                draw.rectangle([x0, y0, x1, y1], fill=(255, 255, 0, 128))  # Semi-transparent yellow
-            
-            # Combine original image with highlights
-            highlighted_img = Image.alpha_composite(img, overlay)
-            highlighted_img = highlighted_img.convert("RGB")
-            
-            # Save the highlighted image
-            highlighted_img.save(output_path, "PNG", quality=95)
-            return output_path
+    def _draw_highlights(self, document, page_num, text_to_highlight, arxiv_id=None):
+        """Page render with the chunk's text highlighted in yellow, as an RGB PIL image."""
+        pdf_page = document.doc.load_page(page_num)
+        
+        # Locate the chunk's text on the page
+        text_instances = self._find_highlight_rects(document, page_num, text_to_highlight)
+        
+        # Get page dimensions for scaling
+        pdf_width = pdf_page.rect.width
+        pdf_height = pdf_page.rect.height
+        
+        # Render the page from the same document, or reuse an earlier render of it
+        page_image = self.render_page_cached(document, page_num, arxiv_id)
+        
+        # Convert to PIL for highlighting
+        img = page_image.convert("RGBA")
+        overlay = Image.new("RGBA", img.size, (255, 255, 255, 0))
+        draw = ImageDraw.Draw(overlay)
+        
+        # Scale coordinates from PDF to image
+        img_width, img_height = img.size
+        
+        x_scale = img_width / pdf_width
+        y_scale = img_height / pdf_height
+        
+        # Draw highlights
+        for rect in text_instances:
+            x0, y0, x1, y1 = rect
+            # Scale coordinates
+            x0 *= x_scale
+            y0 *= y_scale
+            x1 *= x_scale
+            y1 *= y_scale
             
-        except Exception as e:
-            print(f"Error creating highlighted page image: {str(e)}")
-            return None
-
-    def generate_page_highlights_for_query(self, pdf_data, highlighted_pages):
-        """Generate highlighted page images for query results."""
-        highlighted_images = []
+            # Draw yellow highlight
+            draw.rectangle([x0, y0, x1, y1], fill=(255, 255, 0, 128))  # Semi-transparent yellow
         
-        # First, get the total number of pages in the PDF
-        try:
-            doc = fitz.open(stream=pdf_data, filetype="pdf")
-            total_pages = doc.page_count
-            doc.close()
-        except Exception as e:
-            print(f"Error getting PDF page count: {str(e)}")
-            total_pages = 20  # Fallback
+        # Combine original image with highlights
+        highlighted_img = Image.alpha_composite(img, overlay)
+        return highlighted_img.convert("RGB")
+    
+    def _paper_key(self, pdf_data):
+        # Keyed on content, so artifacts of a PDF that was since replaced are never served
+        return pdf_digest(pdf_data)
+    
+    def _open_document(self, pdf_data, arxiv_id):
+        return self.document_cache.document(arxiv_id, pdf_data) if arxiv_id else PDFDocument(pdf_data)
+    
+    def highlight_artifact(self, pdf_data, page_num, text_to_highlight, arxiv_id=None, document=None):
+        """
+        Highlighted page PNG in the artifact cache, keyed by paper, page and a hash of the text,
+        rendered only on a miss. Returns (key, path); the key doubles as the highlight ID.
+        """
+        key = self.artifacts.make_key(
+            "highlight", self._paper_key(pdf_data), page_num, RENDER_DPI, self.artifacts.text_hash(text_to_highlight)
+        )
+        path = self.artifacts.get_path(key)
+        if path:
+            return key, path
         
-        for highlight_info in highlighted_pages:
-            try:
-                text = highlight_info.get('text', '')
-                chunk_index = int(highlight_info.get('chunk_index', 0))
-                
-                # Better page estimation: use chunk index with improved calculation
-                # Assume average 2-4 chunks per page, with some variation
-                base_page = max(0, chunk_index // 3)  # 0-indexed
-                # Cap at actual document page count
-                estimated_page = min(base_page, total_pages - 1)
-                
-                print(f"Generating highlight for chunk {chunk_index}: estimated page {estimated_page} (0-indexed) of {total_pages} total pages")
-                
-                # Create highlighted image
-                highlight_id = str(uuid.uuid4())
-                highlight_path = os.path.join(self.temp_dir, f"highlight_{highlight_id}.png")
-                
-                result = self.create_highlighted_page_image(
-                    pdf_data, 
-                    estimated_page,  # 0-indexed for the function
-                    text[:500],  # First 500 chars for highlighting
-                    highlight_path
-                )
-                
-                if result:
-                    highlighted_images.append({
-                        "id": highlight_id,
-                        "path": highlight_path,
-                        "page": estimated_page + 1,  # 1-indexed for display
-                        "chunk_index": chunk_index,
-                        "similarity_score": highlight_info.get('similarity_score', 0),
-                        "text_preview": text[:200] + "..." if len(text) > 200 else text
-                    })
-                    print(f"Generated highlighted image for chunk {chunk_index} on page {estimated_page + 1}")
-                else:
-                    print(f"Failed to generate highlighted image for chunk {chunk_index}")
-                    
-            except Exception as e:
-                print(f"Error generating page highlight: {str(e)}")
-                continue
+        def render(document):
+            if page_num < 0 or page_num >= document.page_count:
+                raise ValueError(f"Page number {page_num} is out of range. Document has {document.page_count} pages.")
+            buffer = BytesIO()
+            self._draw_highlights(document, page_num, text_to_highlight, arxiv_id).save(buffer, "PNG")
+            return buffer.getvalue()
         
-        return highlighted_images
-
+        if document is not None:
+            return key, self.artifacts.put(key, render(document))
+        with self._open_document(pdf_data, arxiv_id) as document:
+            return key, self.artifacts.put(key, render(document))
+    
+    def chunk_highlight_artifact(self, pdf_data, highlight_info, page_offsets=None, arxiv_id=None):
+        """
+        Highlighted page PNG for one chunk, placed like highlight_geometry.
+        Returns (1-indexed page, key, path). With the page offset table a cache hit parses nothing.
+        """
+        if page_offsets:
+            page_num = self.resolve_highlight_page(highlight_info, page_offsets, len(page_offsets))
+        else:
+            with self._open_document(pdf_data, arxiv_id) as document:
+                page_num = self.resolve_highlight_page(highlight_info, page_offsets, document.page_count)
+        key, path = self.highlight_artifact(pdf_data, page_num, highlight_info.get('text', ''), arxiv_id=arxiv_id)
+        return page_num + 1, key, path
+    
+    def resolve_highlight_page(self, highlight_info, page_offsets, total_pages=None):
+        """0-indexed page a chunk should be highlighted on (uncapped when the page count is unknown)."""
+        chunk_index = int(highlight_info.get('chunk_index') or 0)
+        chunk_start_pos = highlight_info.get('chunk_start_pos')
+        known_page = highlight_info.get('estimated_page')
+        # Chunks indexed before the offset table stored running chunk lengths, not text offsets
+        page_exact = str(highlight_info.get('page_exact')) == 'True'
+        
+        if page_offsets and page_exact and chunk_start_pos not in (None, ''):
+            # Exact page from the chunk's offset into the extracted text
+            base_page = page_for_offset(page_offsets, int(chunk_start_pos))
+        elif known_page not in (None, '', 'N/A'):
+            # Page recorded in the chunk metadata at indexing time (1-indexed)
+            base_page = max(0, int(known_page) - 1)
+        else:
+            # Assume average 2-4 chunks per page, with some variation
+            base_page = max(0, chunk_index // 3)  # 0-indexed
+        # Cap at actual document page count
+        if total_pages is None:
+            return base_page
+        return min(base_page, total_pages - 1)
+    
+    def highlight_geometry(self, pdf_data, highlight_info, page_offsets=None, arxiv_id=None):
+        """
+        Where a chunk sits on its page, for clients that draw highlight overlays themselves:
+        the 1-indexed page, its size in PDF points and the highlight rects normalized to 0-1.
+        """
+        with self._open_document(pdf_data, arxiv_id) as document:
+            page_num = self.resolve_highlight_page(highlight_info, page_offsets, document.page_count)
+            pdf_page = document.doc.load_page(page_num)
+            page_width, page_height = pdf_page.rect.width, pdf_page.rect.height
+            rects = self._find_highlight_rects(document, page_num, highlight_info.get('text', ''))
+            
+        return {
+            "page": page_num + 1,
+            "page_width": page_width,
+            "page_height": page_height,
+            "rects": [
+                [round(x0 / page_width, 5), round(y0 / page_height, 5), round(x1 / page_width, 5), round(y1 / page_height, 5)]
+                for x0, y0, x1, y1 in rects
+            ]
+        }
+    
+    def page_image_artifact(self, pdf_data, page_num, arxiv_id=None):
+        """Path of a plain page PNG (0-indexed) to draw overlays on, or None if the page does not exist."""
+        key = self.artifacts.make_key("page", self._paper_key(pdf_data), page_num, RENDER_DPI)
+        path = self.artifacts.get_path(key)
+        if path:
+            return path
+        
+        with self._open_document(pdf_data, arxiv_id) as document:
+            if page_num < 0 or page_num >= document.page_count:
+                return None
+            page_image = self.render_page_cached(document, page_num, arxiv_id)
+        buffer = BytesIO()
+        page_image.save(buffer, "PNG")
+        return self.artifacts.put(key, buffer.getvalue())
+    
     def cleanup(self):
         """Clean up temporary files."""
         for filename in os.listdir(self.temp_dir):
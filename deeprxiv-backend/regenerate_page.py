@@ -8,7 +8,7 @@ import json
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from database import SessionLocal, Paper
-from main import create_nextjs_folder_structure
+from paper_pipeline import create_nextjs_folder_structure
 
 def regenerate_paper_page(arxiv_id):
     """Regenerate the page.tsx for a specific paper"""
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Runs queued paper processing jobs outside the API process.
+
+    python -m worker                 # one worker
+    python -m worker --processes 4   # four worker processes
+
+A worker that dies mid-job stops renewing its lease, and the job is picked up again once the lease expires.
+
+Without CHROMA_HOST the search index is the local deeprxiv_chroma_db directory, which only one
+writer process may use, so workers run as a single process on the API's host. With a Chroma server
+(CHROMA_HOST/CHROMA_PORT) several processes can share it, and workers on other machines also need the
+database and blob store. The generated Next.js pages are always written to the worker host's
+deeprxiv-frontend tree.
+"""
+
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv('.env.local')
+
+from database import SessionLocal, create_tables
+from paper_indexer import CHROMA_HOST
+from job_queue import (
+    JOB_LEASE_SECONDS, JobProgress, claim_job, complete_job, fail_job, make_worker_id, renew_lease
+)
+
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+
+def _keep_lease(job_id, worker_id, stop, lease_lost):
+    """
+    Renew the job's lease until `stop` is set. Sets `lease_lost` once the job was reclaimed,
+    or once renewals have failed for long enough that the lease has expired.
+    """
+    last_renewed = time.monotonic()
+    while not stop.wait(JOB_LEASE_SECONDS / 3):
+        db = SessionLocal()
+        try:
+            if not renew_lease(db, job_id, worker_id):
+                print(f"⚠️ Lost the lease on job {job_id}; another worker may pick it up")
+                lease_lost.set()
+                return
+            last_renewed = time.monotonic()
+        except Exception as e:
+            db.rollback()
+            print(f"Error renewing lease on job {job_id}: {str(e)}")
+            if time.monotonic() - last_renewed >= JOB_LEASE_SECONDS:
+                print(f"⚠️ Lease on job {job_id} expired while renewals were failing")
+                lease_lost.set()
+                return
+        finally:
+            db.close()
+
+def run_job(job, worker_id, pipeline):
+    stop = threading.Event()
+    # Checked by the pipeline between stages, so a reclaimed job stops writing sections and chunks
+    lease_lost = threading.Event()
+    lease_thread = threading.Thread(target=_keep_lease, args=(job.id, worker_id, stop, lease_lost), daemon=True)
+    lease_thread.start()
+
+    error = None
+    try:
+        print(f"👷 {worker_id} processing {job.arxiv_id} (job {job.id}, attempt {job.attempts}/{job.max_attempts})")
+        # process_paper reports failures through its status message instead of raising
+        progress = JobProgress(job.id, worker_id)
+        if pipeline.process_paper(job.arxiv_id, status=progress, cancel=lease_lost) is None:
+            error = progress.get(job.arxiv_id) or f"Paper {job.arxiv_id} not found"
+    except Exception as e:
+        traceback.print_exc()
+        error = str(e)
+    finally:
+        stop.set()
+        lease_thread.join()
+
+    if lease_lost.is_set():
+        # The job belongs to whichever worker reclaimed it; its result is not ours to record
+        print(f"🛑 Dropped the result of job {job.id} for {job.arxiv_id} after losing its lease")
+        return
+
+    db = SessionLocal()
+    try:
+        if error:
+            fail_job(db, job.id, worker_id, error)
+        else:
+            complete_job(db, job.id, worker_id)
+            print(f"✅ Job {job.id} for {job.arxiv_id} completed")
+    finally:
+        db.close()
+
+def run_worker(max_jobs=None):
+    """Claim and run jobs until interrupted (or until `max_jobs` have run)."""
+    # Imported here so each spawned worker process builds its own services
+    import paper_pipeline
+
+    worker_id = make_worker_id()
+    print(f"👷 Worker {worker_id} waiting for jobs")
+    try:
+        _run_jobs(worker_id, paper_pipeline, max_jobs)
+    except KeyboardInterrupt:
+        print(f"👷 Worker {worker_id} stopped")
+
+def _run_jobs(worker_id, pipeline, max_jobs):
+    jobs_run = 0
+    while max_jobs is None or jobs_run < max_jobs:
+        db = SessionLocal()
+        try:
+            job = claim_job(db, worker_id)
+        except Exception as e:
+            db.rollback()
+            print(f"Error claiming a job: {str(e)}")
+            job = None
+        finally:
+            db.close()
+
+        if job is None:
+            time.sleep(WORKER_POLL_SECONDS)
+            continue
+        run_job(job, worker_id, pipeline)
+        jobs_run += 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Run DeepRxiv paper processing workers")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("WORKER_PROCESSES", "1")),
+                        help="Number of worker processes")
+    args = parser.parse_args()
+
+    create_tables()
+    if args.processes > 1 and not CHROMA_HOST:
+        print(f"⚠️ The local Chroma directory allows one writer process; set CHROMA_HOST to run {args.processes} workers")
+        args.processes = 1
+    if args.processes <= 1:
+        run_worker()
+        return
+
+    # Workers are not daemonic so they can start their own figure extraction pools
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_worker, name=f"worker-{i}") for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    print(f"Started {len(processes)} worker processes")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("Worker stopped")